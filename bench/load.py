@@ -0,0 +1,271 @@
+"""Load test of the game input wizard against in-process fakes.
+
+Usage: python -m bench.load --redis URL [--chats N] [--output FILE] ...
+
+Thousands of simulated users enter a game from /newgame to OK at the same
+time. Telegram Bot API and msliga.ru API are replaced with in-process fakes
+with configurable latency and failure rate. Streams of the publisher need a
+real Redis server, its database is flushed. Latency of every stage and
+throughput are printed and saved as json, by default to
+bench/results/<commit>.json, to track regressions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+import aiohttp
+import pendulum
+import telepot.aio
+from squashbot.app import SquashBot
+from squashbot.outbox import Outbox
+from squashbot.session import MSK
+from squashbot.storage import create_redis
+
+STAGES = [
+    'newgame', 'location', 'date', 'time',
+    'first_player', 'second_player', 'result', 'confirmation'
+]
+ADMIN_CHAT = -1
+LEAGUES = 5
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class FakeKortovNet(object):
+    """msliga.ru API answering from memory after a random delay."""
+
+    def __init__(self, players=500, locations=20, latency=0.05, failures=0.0):
+        """Init."""
+        super(FakeKortovNet, self).__init__()
+        self.latency = latency
+        self.failures = failures
+        self.calls = 0
+        self.locations = [dict(id=i, title="Court #{}".format(i)) for i in range(locations)]
+        self.players = [
+            dict(
+                competitor_id=i,
+                league_id=i % LEAGUES,
+                last_name="Player{}".format(i),
+                first_name="Name{}".format(i % 37)
+            )
+            for i in range(players)
+        ]
+
+    async def _call(self, result):
+        self.calls += 1
+        await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency else 0)
+        if random.random() < self.failures:
+            raise aiohttp.ClientError("Fake API failure")
+        return result
+
+    def link_for_player(self, league, player):
+        return "http://localhost/competitors/{}/leagues/{}/".format(player, league)
+
+    async def get_all_players(self, league_group_id, timeout=None):
+        return await self._call(self.players)
+
+    async def get_locations(self, timeout=None):
+        return await self._call(self.locations)
+
+    async def publish_result(self, idempotency_key=None, timeout=None, **game):
+        return await self._call(dict(game, id=self.calls))
+
+    async def publish_results(self, games, timeout=None):
+        return await self._call([dict(game, id=self.calls) for game in games])
+
+    async def close(self):
+        pass
+
+
+def fake_telegram(latency):
+    """Return DelegatorBot class answering Bot API calls from memory."""
+    class FakeTelegram(telepot.aio.DelegatorBot):
+        replies = {}
+        announcements = 0
+        edits = 0
+
+        async def _answer(self):
+            await asyncio.sleep(random.expovariate(1 / latency) if latency else 0)
+
+        async def sendMessage(self, chat_id, text, **kwargs):
+            await self._answer()
+            if chat_id == ADMIN_CHAT:
+                FakeTelegram.announcements += 1
+            elif chat_id in self.replies:
+                self.replies[chat_id].put_nowait((text, kwargs.get('reply_markup')))
+            return dict(message_id=random.randint(1, 1 << 30), chat=dict(id=chat_id), text=text)
+
+        async def editMessageText(self, msg_identifier, text, **kwargs):
+            await self._answer()
+            if msg_identifier[0] == ADMIN_CHAT:
+                FakeTelegram.edits += 1
+            return dict(message_id=msg_identifier[1], chat=dict(id=msg_identifier[0]), text=text)
+
+        async def getChatMember(self, chat_id, user_id):
+            await self._answer()
+            return dict(status='member', user=dict(id=user_id))
+
+    return FakeTelegram
+
+
+class User(object):
+    """Simulated user entering one game."""
+
+    def __init__(self, bot, user_id, api, timeout):
+        super(User, self).__init__()
+        self.bot = bot
+        self.id = user_id
+        self.api = api
+        self.timeout = timeout
+        self.replies = asyncio.Queue()
+        self.bot.replies[user_id] = self.replies
+        self.message_id = 0
+
+    def message(self, text):
+        self.message_id += 1
+        return {
+            'message_id': self.message_id,
+            'from': {'id': self.id, 'first_name': 'User', 'username': 'user{}'.format(self.id)},
+            'chat': {'id': self.id, 'type': 'private', 'first_name': 'User'},
+            'date': int(time.time()),
+            'text': text,
+        }
+
+    def inputs(self):
+        league = random.randrange(LEAGUES)
+        player1, player2 = random.sample([p for p in self.api.players if p['league_id'] == league], 2)
+        name = lambda p: "{} {}".format(p['last_name'], p['first_name'])
+        return [
+            '/newgame',
+            random.choice(self.api.locations)['title'],
+            pendulum.now(MSK).subtract(days=1).strftime('%d.%m.%y'),
+            '19:30',
+            name(player1),
+            name(player2),
+            '3:1',
+            'OK',
+        ]
+
+    async def play(self, stats):
+        """Enter the game recording latency of every stage."""
+        for stage, text in zip(STAGES, self.inputs()):
+            started = time.monotonic()
+            self.bot.handle(self.message(text))
+            try:
+                await asyncio.wait_for(self.replies.get(), self.timeout)
+            except asyncio.TimeoutError:
+                stats[stage]['errors'] += 1
+                return False
+            stats[stage]['latencies'].append(time.monotonic() - started)
+        return True
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else None
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def run(args):
+    redis = await create_redis(args.redis)
+    await redis.flushdb()
+
+    api = FakeKortovNet(args.players, args.locations, args.api_latency, args.api_failures)
+    app = SquashBot(
+        '0:fake', ADMIN_CHAT, None, league_group_id=1, timeout=args.idle,
+        digest_window=args.digest_window, digest_size=args.digest_size, digest_edit=args.digest_edit
+    )
+    app.bot_class = fake_telegram(args.telegram_latency)
+    app.api = api
+    if not args.rate_limits:
+        app.outbox = Outbox(rate=1e9, chat_rate=1e9, chat_burst=1e9, group_rate=1e9, group_burst=1e9)
+    await app.start(redis=redis)
+    # handler timeouts are delivered through the bot's event loop
+    app.bot.scheduler.on_event(app.bot.handle)
+
+    stats = {stage: dict(latencies=[], errors=0) for stage in STAGES}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user(user_id):
+        async with semaphore:
+            return await User(app.bot, user_id, api, args.timeout).play(stats)
+
+    started = time.monotonic()
+    done = await asyncio.gather(*[user(i + 1) for i in range(args.chats)])
+    elapsed = time.monotonic() - started
+    # let idle handlers save their sessions and close before Redis is closed
+    await asyncio.sleep(args.idle + 1)
+    await app.stop()
+
+    messages = sum(len(s['latencies']) for s in stats.values())
+    return dict(
+        commit=commit(),
+        timestamp=pendulum.now().to_iso8601_string(),
+        config=vars(args),
+        elapsed=elapsed,
+        completed=sum(done),
+        failed=len(done) - sum(done),
+        messages_per_second=messages / elapsed,
+        api_calls=api.calls,
+        announcements=app.bot.announcements,
+        announcement_edits=app.bot.edits,
+        stages={
+            stage: dict(
+                count=len(s['latencies']),
+                errors=s['errors'],
+                p50_ms=percentile(s['latencies'], 0.5),
+                p99_ms=percentile(s['latencies'], 0.99),
+            )
+            for stage, s in stats.items()
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=2000, help="chats entering games simultaneously")
+    parser.add_argument('--players', type=int, default=500)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--api-latency', type=float, default=0.05, help="mean msliga.ru latency, s")
+    parser.add_argument('--api-failures', type=float, default=0.0, help="share of failed msliga.ru calls")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="mean Bot API latency, s")
+    parser.add_argument('--rate-limits', action='store_true', help="keep Telegram rate limits of the outbox")
+    parser.add_argument('--timeout', type=int, default=60, help="seconds to wait for a reply")
+    parser.add_argument('--idle', type=int, default=10, help="seconds before an idle chat handler is closed")
+    parser.add_argument('--digest-window', type=float, help="seconds to collect announcements into a digest")
+    parser.add_argument('--digest-size', type=int, default=10, help="announcements in one digest")
+    parser.add_argument('--digest-edit', action='store_true', help="extend the last digest by editing it")
+    parser.add_argument('--redis', required=True, help="Redis URL, it is flushed")
+    parser.add_argument('--output', help="json file for results")
+    args = parser.parse_args()
+
+    result = asyncio.get_event_loop().run_until_complete(run(args))
+
+    print("{completed} games, {failed} failed in {elapsed:.1f}s, {messages_per_second:.0f} messages/s".format(**result))
+    print("{:>14} {:>7} {:>7} {:>10} {:>10}".format('stage', 'count', 'errors', 'p50, ms', 'p99, ms'))
+    for stage in STAGES:
+        s = result['stages'][stage]
+        print("{:>14} {:>7} {:>7} {:>10.1f} {:>10.1f}".format(
+            stage, s['count'], s['errors'], s['p50_ms'] or 0, s['p99_ms'] or 0
+        ))
+
+    output = args.output or os.path.join(RESULTS_DIR, "{}.json".format(result['commit']))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    print("Results are saved to {}".format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Fake Telegram posting recorded updates to the webhook.
+
+Usage: python -m bench.replay updates.jsonl [url] [concurrency]
+
+File contains one Update object per line. Updates of the same chat are
+posted one after another, different chats concurrently, like Telegram does.
+Without url they are posted to the local server on port 8080, the path is
+WEBHOOK_PATH or the secret one derived from TELEGRAM_TOKEN as run_bot.py does.
+"""
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+import aiohttp
+from squashbot.webhook import secret_path, update_chat_id
+
+URL = 'http://localhost:8080'
+CONCURRENCY = 100
+
+
+async def post_chat(session, url, updates, semaphore, latencies):
+    for update in updates:
+        async with semaphore:
+            started = time.time()
+            async with session.post(url, json=update) as resp:
+                resp.raise_for_status()
+            latencies.append(time.time() - started)
+
+
+def default_url():
+    return URL + (os.environ.get('WEBHOOK_PATH') or secret_path(os.environ.get('TELEGRAM_TOKEN', '')))
+
+
+async def replay(path, url, concurrency=CONCURRENCY):
+    """Post updates from file and return list of request latencies."""
+    chats = collections.OrderedDict()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                update = json.loads(line)
+                chats.setdefault(update_chat_id(update), []).append(update)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[
+            post_chat(session, url, updates, semaphore, latencies)
+            for updates in chats.values()
+        ])
+    return latencies
+
+
+def main(path, url=None, concurrency=CONCURRENCY):
+    started = time.time()
+    latencies = sorted(asyncio.get_event_loop().run_until_complete(
+        replay(path, url or default_url(), int(concurrency))
+    ))
+    elapsed = time.time() - started
+    if latencies:
+        print("{} updates in {:.2f}s, {:.0f} updates/s, p50 {:.1f}ms, p99 {:.1f}ms".format(
+            len(latencies), elapsed, len(latencies) / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
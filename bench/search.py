@@ -0,0 +1,63 @@
+"""Compare player search index with fuzzywuzzy scan.
+
+Usage: python -m bench.search [roster sizes...]
+"""
+import random
+import sys
+import timeit
+from fuzzywuzzy import process
+from squashbot.search import SearchIndex
+
+LAST_NAMES = [
+    'Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов',
+    'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков', 'Алексеев', 'Хохлов',
+    'Щукин', 'Яковлев', 'Жуков', 'Федоров', 'Михайлов', 'Беляев', 'Тарасов',
+]
+FIRST_NAMES = [
+    'Иван', 'Петр', 'Алексей', 'Дмитрий', 'Сергей', 'Андрей', 'Юрий', 'Илья',
+    'Артем', 'Максим', 'Николай', 'Павел', 'Олег', 'Михаил', 'Егор',
+]
+SUFFIXES = ['', 'ский', 'енко', 'ин', 'цев', 'ихин', 'ов']
+PATRONYMICS = [
+    'Иванович', 'Петрович', 'Алексеевич', 'Дмитриевич', 'Сергеевич', 'Андреевич',
+    'Юрьевич', 'Ильич', 'Максимович', 'Николаевич', 'Павлович', 'Олегович',
+]
+QUERIES = ['иван', 'ivanov', 'Петро', 'hohlov iurii', 'Шукин', 'смирнв', 'Maksim', 'Волк Олег']
+SIZES = [100, 1000, 5000]
+REPEAT = 5
+
+
+def roster(size, seed=0):
+    """Generate unique names resembling the league roster."""
+    # namesakes of large rosters are told apart by patronymic
+    parts = [LAST_NAMES, SUFFIXES, FIRST_NAMES, PATRONYMICS]
+    if size > len(LAST_NAMES) * len(SUFFIXES) * len(FIRST_NAMES) * len(PATRONYMICS):
+        raise ValueError("Can't generate {} unique names".format(size))
+    rnd = random.Random(seed)
+    names = set()
+    while len(names) < size:
+        names.add("{}{} {} {}".format(*[rnd.choice(part) for part in parts]))
+    return sorted(names)
+
+
+def best(stmt, number):
+    """Return best time of single call in milliseconds."""
+    return min(timeit.repeat(stmt, number=number, repeat=REPEAT)) / number * 1000
+
+
+def main(sizes):
+    print("{:>6} {:>10} {:>14} {:>14}".format('size', 'build, ms', 'extract, ms', 'index, ms'))
+    for size in sizes:
+        names = roster(size)
+        players = {name: None for name in names}
+        build = best(lambda: SearchIndex(players), number=1)
+        index = SearchIndex(players)
+        scan = best(lambda: [process.extract(q, players.keys(), limit=10) for q in QUERIES], number=1)
+        search = best(lambda: [index.search(q, limit=10) for q in QUERIES], number=10)
+        print("{:>6} {:>10.2f} {:>14.3f} {:>14.3f}".format(
+            size, build, scan / len(QUERIES), search / len(QUERIES)
+        ))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
@@ -0,0 +1,179 @@
+"""Cold start of the bot: import time breakdown and time to the first reply.
+
+Usage: python -m bench.startup --redis URL [--runs N] [--target MS]
+       python -m bench.startup --imports N
+
+Every run is a new process which imports the bot, starts it against
+in-process fakes of Telegram and msliga.ru (see bench.load) and handles
+/newgame. Time is counted from the start of the process to the reply, so
+interpreter startup and imports are included. The first run has no
+snapshot and downloads roster and locations, the following ones start from
+the snapshot it saves, as a restarted dyno does. The command fails when the
+median warm start is slower than --target.
+"""
+import argparse
+import asyncio
+import importlib.abc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TARGET = 1000  # ms from process start to the first reply
+RUNS = 5
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Finder measuring execution time of every imported module.
+
+    python -X importtime is not available before 3.7. Cumulative time of
+    a module includes modules imported by it, self time doesn't.
+    """
+
+    def __init__(self):
+        super(ImportTimer, self).__init__()
+        self.times = {}
+        self._stack = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def measure(self, name, run):
+        self._stack.append(0)
+        started = time.perf_counter()
+        try:
+            run()
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.times[name] = (elapsed, elapsed - children)
+
+
+class TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, timer):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.timer.measure(module.__name__, lambda: self.loader.exec_module(module))
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+def imports(top):
+    """Print modules imported by the bot which take most of the time."""
+    timer = ImportTimer()
+    sys.meta_path.insert(0, timer)
+    started = time.perf_counter()
+    import squashbot.app  # noqa
+    total = time.perf_counter() - started
+    sys.meta_path.remove(timer)
+    print("squashbot.app is imported in {:.1f}ms, {} modules".format(total * 1000, len(timer.times)))
+    print("{:>10} {:>10}  {}".format('self, ms', 'cumul, ms', 'module'))
+    for name, (cumulative, own) in sorted(timer.times.items(), key=lambda x: -x[1][1])[:top]:
+        print("{:>10.1f} {:>10.1f}  {}".format(own * 1000, cumulative * 1000, name))
+
+
+async def first_reply(redis_url, snapshot, api_latency, process_started):
+    """Start the bot, send /newgame and return times of the steps since process start."""
+    from squashbot.app import SquashBot
+    times = dict(imported=time.time() - process_started)
+    from squashbot.storage import create_redis
+    from bench.load import ADMIN_CHAT, FakeKortovNet, fake_telegram, User
+
+    redis = await create_redis(redis_url)
+    app = SquashBot('0:fake', ADMIN_CHAT, None, league_group_id=1, snapshot_path=snapshot)
+    app.bot_class = fake_telegram(0)
+    app.api = FakeKortovNet(latency=api_latency)
+    await app.start(redis=redis)
+    times['started'] = time.time() - process_started
+    user = User(app.bot, 1, app.api, timeout=60)
+    app.bot.handle(user.message('/newgame'))
+    await user.replies.get()
+    times['first_reply'] = time.time() - process_started
+    await app.stop()
+    return times
+
+
+def child(args):
+    times = asyncio.get_event_loop().run_until_complete(
+        first_reply(args.redis, args.snapshot, args.api_latency, args.started)
+    )
+    print(json.dumps(times))
+
+
+def run(args, snapshot):
+    command = [
+        sys.executable, '-m', 'bench.startup', '--child',
+        '--redis', args.redis, '--snapshot', snapshot, '--api-latency', str(args.api_latency),
+        '--started', repr(time.time()),
+    ]
+    output = subprocess.check_output(command, stderr=subprocess.DEVNULL)
+    return {k: v * 1000 for k, v in json.loads(output.decode().strip().splitlines()[-1]).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=RUNS, help="warm starts to measure")
+    parser.add_argument('--target', type=float, default=TARGET, help="ms allowed for the median warm start")
+    parser.add_argument('--api-latency', type=float, default=0.5, help="mean msliga.ru latency, s")
+    parser.add_argument('--redis', help="Redis URL, it is flushed, required unless --imports is given")
+    parser.add_argument('--imports', type=int, metavar='N', help="only print N slowest imports")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--snapshot', help=argparse.SUPPRESS)
+    parser.add_argument('--started', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+    if args.imports:
+        imports(args.imports)
+        return
+    if not args.redis:
+        parser.error("--redis is required, its database is flushed")
+
+    from squashbot.storage import create_redis
+
+    async def flush():
+        redis = await create_redis(args.redis)
+        await redis.flushdb()
+        redis.close()
+        await redis.wait_closed()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, 'squashbot.snapshot')
+        results = []
+        for i in range(args.runs + 1):
+            # Redis would keep roster and locations between runs as well
+            asyncio.get_event_loop().run_until_complete(flush())
+            results.append(run(args, snapshot))
+            print("{:>5} imported {imported:7.1f}ms  started {started:7.1f}ms  first reply {first_reply:7.1f}ms".format(
+                'cold' if i == 0 else 'warm', **results[-1]
+            ))
+
+    median = statistics.median(r['first_reply'] for r in results[1:])
+    print("Median warm start {:.1f}ms, target {:.0f}ms".format(median, args.target))
+    if median > args.target:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,69 +1,136 @@
 """Kortov.net API implementation."""
-import requests as reqs
+import asyncio
+import aiohttp
+
+TIMEOUT = 10  # default timeout for single API call in seconds
+CONCURRENCY = 8  # max number of simultaneous API calls
 
 
 class KortovNet(object):
-    """docstring for KortovNet."""
+    """Asynchronous Kortov.net API client.
+
+    Single instance is shared by all chat handlers: it keeps one keep-alive
+    connection pool and caps the number of simultaneous requests, so slow
+    API never blocks the event loop.
+    """
 
-    def __init__(self, host="http://msliga.ru/api/v0", token=None):
+    def __init__(self, host="http://msliga.ru/api/v0", token=None,
+                 timeout=TIMEOUT, concurrency=CONCURRENCY, trace_configs=None):
         """Init."""
         super(KortovNet, self).__init__()
         self.host = host
         self.token = token
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.trace_configs = trace_configs
+        self._session = None
+        self._semaphore = None
+
+    @property
+    def session(self):
+        """Return shared HTTP session, create it on first use."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.concurrency,
+                    keepalive_timeout=60
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=self.trace_configs,
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        """Close connection pool."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method, path, timeout=None, **kwargs):
+        """Make API call and return decoded json response."""
+        session = self.session
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        async with self._semaphore:
+            async with session.request(method, self.host + path, **kwargs) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
 
     def link_for_player(self, league, player):
         """Generate link for players page in the league."""
         return "http://msliga.ru/competitors/{}/leagues/{}/".format(player, league)
 
-    def get_leagues(self):
+    async def get_leagues(self, timeout=None):
         """Return list of active leagues."""
-        return reqs.get("{host}/leagues/".format(
-            host=self.host,
-        )).json()
+        return await self._request('GET', "/leagues/", timeout=timeout)
 
-    def get_players(self, league_id):
+    async def get_players(self, league_id, timeout=None):
         """Return active player list for specified league."""
-        return reqs.get("{host}/leagues/{league_id}/players/".format(
-            host=self.host,
+        return await self._request('GET', "/leagues/{league_id}/players/".format(
             league_id=league_id
-        )).json()
+        ), timeout=timeout)
 
-    def get_all_players(self, league_group_id):
+    async def get_all_players(self, league_group_id, timeout=None):
         """Return full player list for specified league group."""
-        return reqs.get("{host}/groups/{league_group_id}/players/".format(
-            host=self.host,
+        return await self._request('GET', "/groups/{league_group_id}/players/".format(
             league_group_id=league_group_id
-        )).json()
+        ), timeout=timeout)
 
-    def get_player_league(self, player_id):
+    async def get_player_league(self, player_id, timeout=None):
         """Return league for specified player."""
-        return reqs.get("{host}/players/{player_id}/league/".format(
-            host=self.host,
+        return await self._request('GET', "/players/{player_id}/league/".format(
             player_id=player_id
-        )).json()
+        ), timeout=timeout)
 
-    def get_locations(self):
+    async def get_locations(self, timeout=None):
         """Return list of available locations."""
-        return reqs.get("{host}/locations/".format(
-            host=self.host,
-        )).json()
-
-    def publish_result(self, lg, p1, p2, r1, r2, loc, time):
-        """Publish game result to the league."""
-        url = "{host}/games/".format(
-            host=self.host
+        return await self._request('GET', "/locations/", timeout=timeout)
+
+    def _game(self, lg, p1, p2, r1, r2, loc, time, idempotency_key=None):
+        game = dict(
+            player1=p1,
+            player2=p2,
+            result1=r1,
+            result2=r2,
+            location=loc,
+            league=lg,
+            end_datetime=time
         )
+        if idempotency_key is not None:
+            game['idempotency_key'] = idempotency_key
+        return game
+
+    def _auth_headers(self, idempotency_key=None):
         headers = {'Authorization': "Token {}".format(self.token)}
-        return reqs.post(
-            url,
-            json=dict(
-                player1=p1,
-                player2=p2,
-                result1=r1,
-                result2=r2,
-                location=loc,
-                league=lg,
-                end_datetime=time
-            ),
-            headers=headers
-        ).json()
+        if idempotency_key is not None:
+            headers['Idempotency-Key'] = idempotency_key
+        return headers
+
+    async def publish_result(self, lg, p1, p2, r1, r2, loc, time, idempotency_key=None, timeout=None):
+        """Publish game result to the league.
+
+        Retried request with the same idempotency key must not create
+        another game.
+        """
+        return await self._request(
+            'POST',
+            "/games/",
+            json=self._game(lg, p1, p2, r1, r2, loc, time),
+            headers=self._auth_headers(idempotency_key),
+            timeout=timeout
+        )
+
+    async def publish_results(self, games, timeout=None):
+        """Publish several game results in one request.
+
+        Each game is a dict of publish_result arguments including its own
+        idempotency_key.
+        """
+        return await self._request(
+            'POST',
+            "/games/",
+            json=[self._game(**game) for game in games],
+            headers=self._auth_headers(),
+            timeout=timeout
+        )
@@ -1,52 +1,78 @@
-"""Script for starting bot in asyncio event loop."""
+"""Script for starting bot in asyncio event loop.
+
+Updates are received with long polling by default. With BOT_MODE=webhook
+they are accepted by HTTP server on PORT and handled by WEBHOOK_WORKERS
+processes.
+
+SIGTERM or SIGINT stops receiving updates, finishes work in progress for
+up to SHUTDOWN_TIMEOUT seconds and exits.
+"""
 import sys
 import os
 import logging
 import asyncio
-import telepot
-from telepot.aio.delegate import pave_event_space, per_chat_id, create_open
-from squashbot.input import GameInputHandler
+import signal
+from squashbot.app import SquashBot, configure_logging
+
+
+def stopping():
+    logging.warning("Already stopping, waiting for work in progress.")
+
+
+def main():
+    # logging settings
+    configure_logging()
+
+    token = os.environ.get('TELEGRAM_TOKEN')  # telegram token
+    mode = os.environ.get('BOT_MODE', 'polling')  # polling or webhook
 
+    if not token:
+        logging.critical("TELEGRAM_TOKEN not specified in environment variable.")
+        sys.exit(-1)
 
-# logging settings
-logging.basicConfig(
-    format='%(asctime)s [%(filename)s:%(lineno)s:%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    level=logging.DEBUG
-)
+    logging.debug('Initializing bot.')
 
-TOKEN = os.environ.get('TELEGRAM_TOKEN')  # telegram token
-TIMEOUT = int(os.environ.get('BOT_TIMEOUT', 60))  # session timeout for bot
+    loop = asyncio.get_event_loop()
 
-if not TOKEN:
-    logging.critical("TELEGRAM_TOKEN not specified in environment variable.")
-    sys.exit(-1)
+    if mode == 'webhook':
+        from squashbot.webhook import WebhookServer
+        try:
+            server = WebhookServer(
+                token,
+                port=int(os.environ.get('PORT', 8080)),
+                path=os.environ.get('WEBHOOK_PATH'),
+                workers=int(os.environ.get('WEBHOOK_WORKERS', 1)),
+                url=os.environ.get('WEBHOOK_URL')
+            )
+        except ValueError as ex:
+            logging.critical("%s", ex)
+            sys.exit(-1)
+    else:
+        server = SquashBot.from_env()
+        logging.debug("Posting admin messages to group chat #%s.", server.admin_chat)
 
-logging.debug('Initializing bot.')
+    loop.run_until_complete(server.start())
+    if mode != 'webhook':
+        server.listen()
 
-admin_chat = int(os.environ.get('ADMIN_CHAT'))
-logging.debug("Posting admin messages to group chat #{}.".format(admin_chat))
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, loop.stop)
 
-bot = telepot.aio.DelegatorBot(TOKEN, [
-    pave_event_space()(
-        per_chat_id(),
-        create_open,
-        GameInputHandler,
-        timeout=TIMEOUT,
-        admin_chat=admin_chat
-    ),
-])
+    logging.debug('Listening ...')
 
-loop = asyncio.get_event_loop()
-loop.create_task(bot.message_loop())
+    try:
+        loop.run_forever()
+    finally:
+        logging.debug('Stopping server begins.')
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            # a repeated signal would stop the loop in the middle of draining
+            loop.add_signal_handler(signum, stopping)
+        loop.run_until_complete(server.stop())
+        loop.close()
 
-logging.debug('Listening ...')
+    logging.debug('Stopping server ends.')
 
-try:
-    loop.run_forever()
-except KeyboardInterrupt:
-    logging.debug('Stopping server begins.')
-finally:
-    loop.close()
 
-logging.debug('Stopping server ends.')
+# worker processes of the webhook are spawned and import this module again
+if __name__ == '__main__':
+    main()
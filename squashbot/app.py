@@ -0,0 +1,271 @@
+"""Bot with resources shared by all chat handlers of the process."""
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import sys
+import telepot
+import telepot.aio.api
+from telepot.aio.delegate import pave_event_space, per_chat_id, per_inline_from_id, create_open
+from kortovnet import KortovNet
+from squashbot.input import GameInputHandler, parse_locations, parse_players
+from squashbot.inline import InlineSearch, InlineSearchHandler
+from squashbot.cache import SharedCache
+from squashbot.session import SessionStore
+from squashbot.favorites import Favorites
+from squashbot.auth import MembershipCache
+from squashbot.publisher import ResultPublisher
+from squashbot.outbox import Outbox, RATE, GROUP_RATE, GROUP_BURST
+from squashbot.digest import Announcer, SIZE as DIGEST_SIZE
+from squashbot.keyboards import KeyboardCache
+from squashbot.storage import create_redis, close_redis
+from squashbot.snapshot import Snapshot
+from squashbot.shutdown import Deadline, Inflight, TIMEOUT as SHUTDOWN_TIMEOUT, POLL_INTERVAL
+from squashbot.metrics import MetricsServer, Profiler, api_trace_config
+from squashbot.logs import JsonFormatter, QueueHandler, QueueWriter, QUEUE_SIZE, parse_levels
+
+INLINE_TIMEOUT = 30  # seconds to keep inline handler of idle user
+
+logger = logging.getLogger(__name__)
+
+TEXT_FORMAT = '%(asctime)s [%(filename)s:%(lineno)s:%(levelname)s] %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+def configure_logging(level=None, levels=None, fmt=None, background=None, environ=os.environ):
+    """Configure logging of the process.
+
+    Arguments default to LOG_LEVEL, LOG_LEVELS (like 'aioredis=WARNING,telepot=INFO'),
+    LOG_FORMAT ('text' or 'json') and LOG_BACKGROUND environment variables.
+    In background mode records are only queued by the event loop and are
+    formatted and written in batches by a separate thread.
+    """
+    level = level or environ.get('LOG_LEVEL', 'DEBUG').upper()
+    levels = levels if levels is not None else parse_levels(environ.get('LOG_LEVELS'))
+    fmt = fmt or environ.get('LOG_FORMAT', 'text')
+    if background is None:
+        background = environ.get('LOG_BACKGROUND', '0').lower() in ('1', 'true', 'yes')
+
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT, TEXT_DATEFMT)
+    if background:
+        handler = QueueHandler(queue.Queue(QUEUE_SIZE))
+        writer = QueueWriter(handler, sys.stderr, formatter)
+        writer.start()
+        atexit.register(writer.stop)
+    else:
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, logger_level in levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+
+class SquashBot(object):
+    """Telegram bot together with API client, Redis pool and caches."""
+
+    bot_class = telepot.aio.DelegatorBot
+
+    def __init__(self, token, admin_chat, redis_url, league_group_id=None,
+                 liga_token=None, timeout=60, cache_ttl=600, auth_ttl=6 * 60 * 60,
+                 liga_timeout=10, liga_concurrency=8, publish_concurrency=4,
+                 publish_batch_size=1, consumer=None, metrics_port=None, profile_interval=None,
+                 snapshot_path=None, digest_window=None, digest_size=DIGEST_SIZE, digest_edit=False,
+                 shutdown_timeout=SHUTDOWN_TIMEOUT, workers=1):
+        """Init.
+
+        workers is the number of processes sending messages with the same token.
+        """
+        super(SquashBot, self).__init__()
+        self.token = token
+        self.admin_chat = admin_chat
+        self.redis_url = redis_url
+        self.league_group_id = league_group_id
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.auth_ttl = auth_ttl
+        self.publish_concurrency = publish_concurrency
+        self.publish_batch_size = publish_batch_size
+        self.consumer = consumer
+        self.metrics_port = metrics_port
+        self.profile_interval = profile_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.api = KortovNet(
+            token=liga_token,
+            timeout=liga_timeout,
+            concurrency=liga_concurrency,
+            trace_configs=[api_trace_config()]
+        )
+        self.redis = None
+        self.publisher = None
+        # Telegram limits the bot as a whole and every worker announces to the
+        # admin chat, so workers split the global and group rates
+        self.outbox = Outbox(
+            rate=RATE / workers,
+            group_rate=GROUP_RATE / workers,
+            group_burst=max(1, GROUP_BURST // workers)
+        )
+        self.digest_window = digest_window
+        self.digest_size = digest_size
+        self.digest_edit = digest_edit
+        self.announcer = None
+        self.inflight = Inflight()
+        self._listening = None
+        self._source = None
+        self.caches = []
+        self.bot = None
+        self.metrics = None
+        self.snapshot = Snapshot(snapshot_path) if snapshot_path else None
+
+    @classmethod
+    def from_env(cls, environ=os.environ, **kwargs):
+        """Create bot configured with environment variables, kwargs override them."""
+        options = dict(
+            token=environ.get('TELEGRAM_TOKEN'),
+            admin_chat=int(environ.get('ADMIN_CHAT')),
+            redis_url=environ.get('REDIS_URL'),
+            league_group_id=environ.get('LEAGUE_GROUP_ID'),
+            liga_token=environ.get('LIGA_TOKEN'),
+            timeout=int(environ.get('BOT_TIMEOUT', 60)),
+            cache_ttl=int(environ.get('CACHE_TTL', 600)),
+            auth_ttl=int(environ.get('AUTH_TTL', 6 * 60 * 60)),
+            liga_timeout=int(environ.get('LIGA_TIMEOUT', 10)),
+            liga_concurrency=int(environ.get('LIGA_CONCURRENCY', 8)),
+            publish_concurrency=int(environ.get('PUBLISH_CONCURRENCY', 4)),
+            publish_batch_size=int(environ.get('PUBLISH_BATCH_SIZE', 1)),
+            consumer=environ.get('DYNO'),
+            metrics_port=int(environ['METRICS_PORT']) if environ.get('METRICS_PORT') else None,
+            profile_interval=float(environ['PROFILE_INTERVAL']) if environ.get('PROFILE_INTERVAL') else None,
+            snapshot_path=environ.get('SNAPSHOT_PATH', 'squashbot.snapshot') or None,
+            digest_window=float(environ['DIGEST_WINDOW']) if environ.get('DIGEST_WINDOW') else None,
+            digest_size=int(environ.get('DIGEST_SIZE', DIGEST_SIZE)),
+            digest_edit=environ.get('DIGEST_EDIT', '0').lower() in ('1', 'true', 'yes'),
+            shutdown_timeout=float(environ.get('SHUTDOWN_TIMEOUT', SHUTDOWN_TIMEOUT)),
+        )
+        options.update(kwargs)
+        return cls(**options)
+
+    async def start(self, redis=None):
+        """Connect to Redis, create the bot and start background workers.
+
+        Already connected redis may be passed instead of redis_url.
+        """
+        self.redis = redis or await create_redis(self.redis_url)
+        players = SharedCache(
+            self.redis,
+            'cache:players:{}'.format(self.league_group_id),
+            lambda: self.api.get_all_players(self.league_group_id),
+            parse=parse_players,
+            ttl=self.cache_ttl
+        )
+        locations = SharedCache(
+            self.redis,
+            'cache:locations',
+            self.api.get_locations,
+            parse=parse_locations,
+            ttl=self.cache_ttl
+        )
+        self.caches = [players, locations]
+        if self.snapshot is not None:
+            self.snapshot.track(players, locations)
+            # stale snapshot is served while fresh data is downloaded
+            players.refresh()
+            locations.refresh()
+        self.publisher = ResultPublisher(
+            self.redis,
+            self.api,
+            consumer=self.consumer,
+            concurrency=self.publish_concurrency,
+            batch_size=self.publish_batch_size
+        )
+        self.announcer = Announcer(self.outbox, window=self.digest_window, size=self.digest_size, edit=self.digest_edit)
+        self.bot = self.bot_class(self.token, [
+            pave_event_space()(
+                per_chat_id(),
+                create_open,
+                GameInputHandler,
+                timeout=self.timeout,
+                admin_chat=self.admin_chat,
+                api=self.api,
+                players=players,
+                locations=locations,
+                sessions=SessionStore(self.redis, ttl=self.timeout),
+                favorites=Favorites(self.redis),
+                members=MembershipCache(self.redis, self.admin_chat, ttl=self.auth_ttl),
+                publisher=self.publisher,
+                outbox=self.outbox,
+                announcer=self.announcer,
+                inflight=self.inflight,
+                keyboards=KeyboardCache()
+            ),
+            pave_event_space()(
+                per_inline_from_id(),
+                create_open,
+                InlineSearchHandler,
+                timeout=INLINE_TIMEOUT,
+                search=InlineSearch(self.api, players, locations)
+            ),
+        ])
+        self.outbox.bot = self.bot
+        self.outbox.start()
+        await self.publisher.start()
+        if self.metrics_port is not None:
+            self.metrics = MetricsServer(
+                port=self.metrics_port,
+                profiler=Profiler(self.profile_interval) if self.profile_interval else None
+            )
+            await self.metrics.start()
+
+    def listen(self, **kwargs):
+        """Start receiving updates, kwargs are passed to message_loop of the bot."""
+        self._source = kwargs.get('source')
+        self._listening = asyncio.ensure_future(self.bot.message_loop(**kwargs))
+        return self._listening
+
+    async def stop(self, timeout=None):
+        """Stop receiving updates, drain work in progress and close connection pools.
+
+        Updates being handled are finished, then games are published and
+        messages are sent until shutdown_timeout passes. Games left in the
+        queue are published by the next start.
+        """
+        deadline = Deadline(self.shutdown_timeout if timeout is None else timeout)
+        if self._listening is not None:
+            if self._source is None:
+                self._listening.cancel()
+                await asyncio.wait([self._listening])
+            else:
+                # updates already accepted by webhook are handled, message_loop
+                # reading a queue ignores cancellation and is left waiting
+                while not self._source.empty() and not deadline.expired:
+                    await asyncio.sleep(POLL_INTERVAL)
+            self._listening = None
+        if not await self.inflight.wait(timeout=deadline.remaining()):
+            logger.warning("Stopping with %s updates being handled.", self.inflight.count)
+
+        async def send():
+            if self.announcer is not None:
+                await self.announcer.stop(timeout=deadline.remaining())
+            await self.outbox.stop(timeout=deadline.remaining())
+
+        # msliga.ru and Telegram are drained at the same time
+        draining = [send()] + [cache.wait(timeout=deadline.remaining()) for cache in self.caches]
+        if self.publisher is not None:
+            draining.append(self.publisher.stop(timeout=deadline.remaining()))
+        await asyncio.gather(*draining)
+        if self.snapshot is not None:
+            await self.snapshot.close()
+        await self.api.close()
+        # telepot closes its HTTP session only at exit and without awaiting it
+        for session in telepot.aio.api._pools.values():
+            await session.close()
+        telepot.aio.api._pools.clear()
+        if self.redis is not None:
+            await close_redis(self.redis)
+        if self.metrics is not None:
+            await self.metrics.stop()
@@ -0,0 +1,61 @@
+"""Cached membership checks for the league chat."""
+import logging
+from telepot.exception import TelegramError
+from squashbot.metrics import TELEGRAM_SECONDS, ERRORS
+
+logger = logging.getLogger(__name__)
+
+TTL = 6 * 60 * 60  # seconds to trust membership answer
+NEGATIVE_TTL = 30  # seconds to remember failed membership check
+MEMBER_STATUSES = ('creator', 'administrator', 'member', 'left')
+
+
+class MembershipCache(object):
+    """Membership of users in the admin chat cached in Redis.
+
+    Answers of Telegram are cached for ttl, failed requests only for
+    negative_ttl. Cache of the user is dropped as soon as the user joins
+    or leaves the chat.
+    """
+
+    def __init__(self, redis, chat_id, ttl=TTL, negative_ttl=NEGATIVE_TTL):
+        """Init."""
+        super(MembershipCache, self).__init__()
+        self.redis = redis
+        self.chat_id = chat_id
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def key(self, user_id):
+        return "member:{}:{}".format(self.chat_id, user_id)
+
+    async def is_member(self, bot, user_id):
+        """Check that user is in the chat asking Telegram only on cache miss."""
+        cached = await self.redis.get(self.key(user_id))
+        if cached is not None:
+            return cached == b'1'
+        try:
+            with TELEGRAM_SECONDS.labels('getChatMember').time():
+                res = await bot.getChatMember(self.chat_id, user_id)
+        except TelegramError:
+            ERRORS.labels('telegram').inc()
+            logger.exception("Checking membership of user %s failed.", user_id)
+            await self.redis.set(self.key(user_id), b'0', expire=self.negative_ttl)
+            return False
+        is_member = res['status'] in MEMBER_STATUSES
+        await self.redis.set(self.key(user_id), b'1' if is_member else b'0', expire=self.ttl)
+        return is_member
+
+    async def invalidate(self, *user_ids):
+        """Forget cached membership of the users."""
+        if user_ids:
+            await self.redis.delete(*[self.key(user_id) for user_id in user_ids])
+
+
+def changed_members(msg):
+    """Return ids of users joined or left the chat in service message."""
+    users = list(msg.get('new_chat_members', []))
+    for field in ('new_chat_member', 'left_chat_member'):
+        if field in msg:
+            users.append(msg[field])
+    return {user['id'] for user in users}
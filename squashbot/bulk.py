@@ -0,0 +1,132 @@
+"""Parsing and publishing many games sent in one message."""
+import asyncio
+import hashlib
+import json
+import logging
+import pendulum
+from squashbot.names import GAME_RESULTS
+from squashbot.session import MSK
+from squashbot.i18n import _
+
+logger = logging.getLogger(__name__)
+
+MAX_GAMES = 100  # lines accepted in one message
+TIME_FORMAT = '%d.%m.%y %H:%M'
+EXAMPLE = 'Court; 12.12.16 19:30; Ivanov Ivan - Petrov Petr 3:1'
+
+
+class BulkGame(object):
+    """Game parsed from one line of the message."""
+
+    __slots__ = ('number', 'line', 'location', 'time', 'player1', 'player2', 'result', 'error')
+
+    def __init__(self, number, line):
+        """Init."""
+        self.number = number
+        self.line = line
+        self.location = None
+        self.time = None
+        self.player1 = None
+        self.player2 = None
+        self.result = None
+        self.error = None
+
+    def title(self):
+        return "{} {} {} - {} {}".format(
+            self.location, self.time.format(TIME_FORMAT), self.player1, self.player2, self.result
+        )
+
+    def data(self, roster, locations):
+        """Return game as accepted by KortovNet.publish_result."""
+        r1, r2 = [int(x) for x in self.result.split(':')]
+        return dict(
+            lg=roster.leagues[self.player1],
+            p1=roster.ids[self.player1],
+            p2=roster.ids[self.player2],
+            r1=r1,
+            r2=r2,
+            loc=locations[self.location],
+            time=self.time.to_atom_string()
+        )
+
+
+def parse_line(number, line, roster, locations):
+    """Parse 'Court; 12.12.16 19:30; Ivanov Ivan - Petrov Petr 3:1' line."""
+    game = BulkGame(number, line)
+    parts = [part.strip() for part in line.split(';')]
+    if len(parts) != 3:
+        game.error = _("Expected three parts separated by ';' like {}").format(EXAMPLE)
+        return game
+    location, time, players = parts
+
+    if location not in locations:
+        game.error = _("Unknown court {}").format(location)
+        return game
+    game.location = location
+
+    try:
+        game.time = pendulum.from_format(time, TIME_FORMAT, MSK)
+    except ValueError:
+        game.error = _("Can't recognize time {}, expected format is 12.12.16 19:30").format(time)
+        return game
+    if game.time.is_future():
+        game.error = _("Game is in the future")
+        return game
+
+    players, _sep, result = players.strip().rpartition(' ')
+    if result not in GAME_RESULTS:
+        game.error = _("Strange result {}").format(result)
+        return game
+    game.result = result
+
+    player1, sep, player2 = players.partition(' - ')
+    player1, player2 = player1.strip(), player2.strip()
+    for player in (player1, player2) if sep else ():
+        if player not in roster:
+            game.error = _("Unknown player {}").format(player)
+            return game
+    if not sep or player1 == player2:
+        game.error = _("Expected two different players like Ivanov Ivan - Petrov Petr")
+        return game
+    if roster.leagues[player1] != roster.leagues[player2]:
+        game.error = _("{} and {} play in different leagues").format(player1, player2)
+        return game
+    game.player1, game.player2 = player1, player2
+    return game
+
+
+def parse_games(text, roster, locations):
+    """Parse games one per line, errors are set on invalid ones."""
+    lines = [line.strip() for line in text.splitlines()]
+    games = [parse_line(i, line, roster, locations) for i, line in enumerate(lines, 1) if line]
+    seen = set()
+    for game in games:
+        if game.error is None:
+            if game.title() in seen:
+                game.error = _("Repeats one of previous lines")
+            seen.add(game.title())
+    return games
+
+
+def idempotency_key(chat_id, data):
+    """Return key identifying the game sent from the chat, so resending it is harmless."""
+    raw = json.dumps([chat_id, data], sort_keys=True).encode()
+    return hashlib.sha1(raw).hexdigest()
+
+
+async def publish_games(publisher, chat_id, games, roster, locations):
+    """Publish games concurrently and return exceptions of failed ones or None.
+
+    Games published already, e.g. when the whole message is sent again after
+    a partial failure, are skipped by the publisher.
+    """
+    async def publish(game):
+        data = game.data(roster, locations)
+        try:
+            await publisher.publish_now(chat_id, data)
+        except Exception as ex:
+            logger.warning("Publishing game %s failed: %r", data, ex)
+            return ex
+        return None
+
+    return await asyncio.gather(*[publish(game) for game in games])
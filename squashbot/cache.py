@@ -0,0 +1,167 @@
+"""Process-wide cache for API data shared by all chat handlers."""
+import asyncio
+import json
+import hashlib
+import logging
+import time
+import uuid
+from aioredis.errors import ReplyError
+from squashbot.metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+TTL = 600  # seconds before cached value should be refreshed
+REFRESH_AHEAD = 0.2  # part of TTL when value is refreshed in background
+STALE_TTL = 24 * 60 * 60  # how long stale value is kept in redis
+LOCK_TIMEOUT = 30  # how long other workers wait for the refreshing one
+POLL_INTERVAL = 0.2
+
+# Lock is deleted only by its owner, the one which expired while the owner
+# was downloading may be taken by another worker already.
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+UNLOCK_SHA = hashlib.sha1(UNLOCK_SCRIPT.encode()).hexdigest()
+
+
+class SharedCache(object):
+    """Cache for slowly changing API data.
+
+    Value is kept in memory of the process and in Redis, so several workers
+    share single download. Value is refreshed in background before it
+    expires (stale-while-revalidate) and concurrent misses are coalesced
+    into a single API request: inside process with shared task, between
+    processes with Redis lock.
+    """
+
+    def __init__(self, redis, key, loader, parse=None, ttl=TTL,
+                 refresh_ahead=REFRESH_AHEAD, stale_ttl=STALE_TTL):
+        """Init.
+
+        loader is a coroutine function returning json-serializable data,
+        parse converts loaded data into the value returned by get.
+        """
+        super(SharedCache, self).__init__()
+        self.redis = redis
+        self.key = key
+        self.loader = loader
+        self.parse = parse or (lambda data: data)
+        self.ttl = ttl
+        self.refresh_after = ttl * (1 - refresh_ahead)
+        self.stale_ttl = max(stale_ttl, ttl)
+        self._value = None
+        self._loaded_at = None
+        self._task = None
+        self.on_store = None  # called with key, data and time when new data is stored
+
+    def _age(self, loaded_at=None):
+        loaded_at = loaded_at or self._loaded_at
+        return time.time() - loaded_at if loaded_at else float('inf')
+
+    async def get(self):
+        """Return cached value, load it if nothing is cached yet."""
+        if self._value is None:
+            # cold start, a stale value saved by any worker is served while
+            # the fresh one is downloaded, even if the download fails
+            data, loaded_at = await self._read()
+            if data is None:
+                return await self.refresh()
+            self._store(data, loaded_at)
+            if self._age() >= self.refresh_after:
+                self.refresh()
+            return self._value
+        age = self._age()
+        if age < self.refresh_after:
+            return self._value
+        if age < self.ttl:
+            self.refresh()
+            return self._value
+        # expired, but redis or other worker may already have a fresh one
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.refresh()), timeout=1)
+        except asyncio.TimeoutError:
+            return self._value
+        except Exception:
+            logger.exception("Refreshing %s failed, serving stale value.", self.key)
+            return self._value
+
+    def refresh(self):
+        """Start refreshing value unless it is already in progress."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._refresh())
+            self._task.add_done_callback(self._refreshed)
+        return self._task
+
+    async def wait(self, timeout=None):
+        """Wait for refresh in progress, so the downloaded value is stored."""
+        if self._task is not None and not self._task.done():
+            await asyncio.wait([self._task], timeout=timeout)
+
+    def _refreshed(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            ERRORS.labels('cache').inc()
+            logger.warning("Refreshing %s failed: %r", self.key, task.exception())
+
+    def warm(self, data, loaded_at):
+        """Use data loaded earlier, e.g. from disk, until a newer one is loaded."""
+        if self._loaded_at is None or loaded_at > self._loaded_at:
+            self._value = self.parse(data)
+            self._loaded_at = loaded_at
+
+    def _store(self, data, loaded_at):
+        self._value = self.parse(data)
+        self._loaded_at = loaded_at
+        if self.on_store is not None:
+            self.on_store(self.key, data, loaded_at)
+        return self._value
+
+    async def _read(self):
+        raw = await self.redis.get(self.key)
+        if raw is None:
+            return None, None
+        entry = json.loads(raw)
+        return entry['data'], entry['ts']
+
+    async def _refresh(self):
+        data, loaded_at = await self._read()
+        if data is not None and (self._loaded_at is None or loaded_at > self._loaded_at):
+            self._store(data, loaded_at)
+            if self._age(loaded_at) < self.refresh_after:
+                return self._value
+
+        lock = self.key + ':lock'
+        token = uuid.uuid4().hex
+        deadline = time.time() + LOCK_TIMEOUT
+        while not await self.redis.set(lock, token, expire=LOCK_TIMEOUT, exist=self.redis.SET_IF_NOT_EXIST):
+            # other worker is downloading the data
+            if self._value is not None:
+                return self._value
+            if time.time() > deadline:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+            data, loaded_at = await self._read()
+            if data is not None:
+                return self._store(data, loaded_at)
+
+        try:
+            data = await self.loader()
+            loaded_at = time.time()
+            await self.redis.set(
+                self.key,
+                json.dumps(dict(ts=loaded_at, data=data)),
+                expire=int(self.stale_ttl)
+            )
+        finally:
+            await self._unlock(lock, token)
+        return self._store(data, loaded_at)
+
+    async def _unlock(self, lock, token):
+        try:
+            await self.redis.evalsha(UNLOCK_SHA, [lock], [token])
+        except ReplyError as ex:
+            if not str(ex).startswith('NOSCRIPT'):
+                raise
+            await self.redis.eval(UNLOCK_SCRIPT, [lock], [token])
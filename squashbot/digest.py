@@ -0,0 +1,111 @@
+"""Announcements of games posted to the admin chat."""
+import asyncio
+import logging
+import time
+from telepot.exception import TelegramError
+from squashbot.outbox import ANNOUNCEMENT
+from squashbot.utils import MAX_LENGTH
+
+logger = logging.getLogger(__name__)
+
+SIZE = 10  # announcements combined into one message
+EDIT_AGE = 60 * 60  # seconds the last digest is extended by editing
+
+
+class LastDigest(object):
+    __slots__ = ('message_id', 'text', 'sent_at')
+
+    def __init__(self, message_id, text, sent_at):
+        self.message_id = message_id
+        self.text = text
+        self.sent_at = sent_at
+
+
+class Announcer(object):
+    """Poster of Markdown announcements to admin chats.
+
+    Without window every announcement is posted at once. With window they
+    are buffered per chat and posted as one message when window seconds
+    pass since the first of them or size of them are collected. With edit
+    the last digest of the chat is extended in place while it is younger
+    than edit_age and fits into one message, so busy evenings produce a
+    single growing post instead of many.
+    """
+
+    def __init__(self, outbox, window=None, size=SIZE, edit=False, edit_age=EDIT_AGE):
+        """Init."""
+        super(Announcer, self).__init__()
+        self.outbox = outbox
+        self.window = window
+        self.size = size
+        self.edit = edit
+        self.edit_age = edit_age
+        self._buffers = {}
+        self._timers = {}
+        self._locks = {}
+        self._last = {}
+        self._flushes = set()
+
+    def announce(self, chat_id, text):
+        """Post the announcement now or add it to the digest of the chat."""
+        if not self.window:
+            self.outbox.post(chat_id, 'sendMessage', text, parse_mode='Markdown', priority=ANNOUNCEMENT)
+            return
+        buffer = self._buffers.setdefault(chat_id, [])
+        buffer.append(text)
+        if len(buffer) >= self.size:
+            self._flush_soon(chat_id)
+        elif chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.get_event_loop().call_later(self.window, self._flush_soon, chat_id)
+
+    def _flush_soon(self, chat_id):
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        texts = self._buffers.pop(chat_id, None)
+        if texts:
+            task = asyncio.ensure_future(self.flush(chat_id, texts))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def flush(self, chat_id, texts):
+        """Post announcements to the chat in as few messages as possible."""
+        messages = []
+        for text in texts:
+            if messages and len(messages[-1]) + 2 + len(text) <= MAX_LENGTH:
+                messages[-1] += "\n\n" + text
+            else:
+                messages.append(text)
+        # the lock is fair, so digests are posted in order they are collected
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            for message in messages:
+                try:
+                    await self._post(chat_id, message)
+                except Exception:
+                    logger.exception("Posting announcements to chat %s failed.", chat_id)
+
+    async def _post(self, chat_id, text):
+        last = self._last.get(chat_id)
+        if self.edit and last is not None and time.monotonic() - last.sent_at < self.edit_age:
+            combined = last.text + "\n\n" + text
+            if len(combined) <= MAX_LENGTH:
+                try:
+                    await self.outbox.send(
+                        chat_id, 'editMessageText', last.message_id, combined,
+                        parse_mode='Markdown', priority=ANNOUNCEMENT
+                    )
+                    last.text = combined
+                    return
+                except TelegramError as ex:
+                    # e.g. the message is deleted, post a new one
+                    logger.warning("Editing digest %s in chat %s failed: %r", last.message_id, chat_id, ex)
+        message = await self.outbox.send(chat_id, 'sendMessage', text, parse_mode='Markdown', priority=ANNOUNCEMENT)
+        self._last[chat_id] = LastDigest(message['message_id'], text, time.monotonic())
+
+    async def stop(self, timeout=None):
+        """Post all buffered announcements."""
+        for chat_id in list(self._buffers):
+            self._flush_soon(chat_id)
+        if self._flushes:
+            await asyncio.wait(list(self._flushes), timeout=timeout)
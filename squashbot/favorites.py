@@ -0,0 +1,98 @@
+"""Favorite locations and players of users stored in Redis."""
+import asyncio
+import hashlib
+import math
+import time
+from aioredis.errors import ReplyError
+
+TOP_LOCS = 3
+TOP_PLAYERS = 3
+MAX_LOCS = 20  # locations kept for each user
+MAX_PLAYERS = 50  # players kept for each user
+HALF_LIFE = 30 * 24 * 60 * 60  # seconds for a use to lose half of its weight
+TTL = 365 * 24 * 60 * 60  # favorites of users inactive for this time are removed
+EPOCH = 1483228800  # 2017-01-01, keeps log-domain scores small
+
+# Score of a member is log of sum of 2 ** ((t - EPOCH) / HALF_LIFE) over all
+# its uses, so it is increased with log-add-exp of the weight of current use
+# and older uses decay without rewriting scores.
+FRECENCY_SCRIPT = """
+local weight = tonumber(ARGV[1])
+for i = 4, #ARGV do
+    local score = weight
+    local old = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if old then
+        old = tonumber(old)
+        local high, low = math.max(old, weight), math.min(old, weight)
+        score = high + math.log(1 + math.exp(low - high))
+    end
+    redis.call('ZADD', KEYS[1], score, ARGV[i])
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.status_reply('OK')
+"""
+FRECENCY_SHA = hashlib.sha1(FRECENCY_SCRIPT.encode()).hexdigest()
+
+
+def weight(now=None):
+    """Return log-domain weight of the use at the moment."""
+    return ((now or time.time()) - EPOCH) / HALF_LIFE * math.log(2)
+
+
+class Favorites(object):
+    """Sorted sets of locations and players ranked by frecency for each user.
+
+    Every use adds exponentially decaying weight to the member in a single
+    atomic script. Sets are trimmed to the most frecent members and expire
+    when the user stops playing.
+    """
+
+    def __init__(self, redis, top_locations=TOP_LOCS, top_players=TOP_PLAYERS,
+                 max_locations=MAX_LOCS, max_players=MAX_PLAYERS, ttl=TTL):
+        """Init."""
+        super(Favorites, self).__init__()
+        self.redis = redis
+        self.top_locations = top_locations
+        self.top_players = top_players
+        self.max_locations = max_locations
+        self.max_players = max_players
+        self.ttl = ttl
+
+    @staticmethod
+    def locations_key(user_id):
+        return "loc:{}".format(user_id)
+
+    @staticmethod
+    def players_key(user_id):
+        return "ps:{}".format(user_id)
+
+    async def top(self, user_id):
+        """Return favorite locations and players of the user.
+
+        Both commands are sent concurrently, so the wait is about one round
+        trip. Unlike pipeline() this doesn't take a connection of the pool
+        exclusively, the pool may send them over different connections.
+        """
+        locations, players = await asyncio.gather(
+            self.redis.zrevrange(self.locations_key(user_id), 0, self.top_locations, encoding='utf-8'),
+            self.redis.zrevrange(self.players_key(user_id), 0, self.top_players, encoding='utf-8')
+        )
+        return locations, players
+
+    async def _use(self, key, size, members):
+        args = [weight(), size, self.ttl] + list(members)
+        try:
+            await self.redis.evalsha(FRECENCY_SHA, [key], args)
+        except ReplyError as ex:
+            if not str(ex).startswith('NOSCRIPT'):
+                raise
+            await self.redis.eval(FRECENCY_SCRIPT, [key], args)
+
+    async def add_location(self, user_id, location):
+        """Count the location as used by the user now."""
+        await self._use(self.locations_key(user_id), self.max_locations, [location])
+
+    async def add_players(self, user_id, *players):
+        """Count the players as chosen by the user now."""
+        await self._use(self.players_key(user_id), self.max_players, players)
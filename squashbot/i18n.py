@@ -0,0 +1,27 @@
+"""Translation of bot messages."""
+import gettext
+import os
+import pendulum
+
+LOCALE = 'ru_RU'
+DOMAIN = 'squashbot'
+
+localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locale')
+
+
+def load_catalog(locale=LOCALE):
+    """Read compiled catalog of the locale into memory, untranslated messages are used without it.
+
+    Unlike gettext.translation nothing is looked up for languages of the
+    environment, only one known file is read.
+    """
+    try:
+        with open(os.path.join(localedir, locale, 'LC_MESSAGES', DOMAIN + '.mo'), 'rb') as f:
+            return gettext.GNUTranslations(f)
+    except OSError:
+        return gettext.NullTranslations()
+
+
+pendulum.set_locale('ru')
+translate = load_catalog()
+_ = translate.gettext
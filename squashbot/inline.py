@@ -0,0 +1,128 @@
+"""Inline query search of players and courts."""
+import asyncio
+import collections
+import json
+import logging
+import telepot
+import telepot.aio.helper
+from squashbot.search import SearchIndex, normalize
+from squashbot.i18n import _
+
+logger = logging.getLogger(__name__)
+
+LIMIT = 20  # results in one answer
+CACHE_SIZE = 1024  # answers kept in memory
+CACHE_TIME = 300  # seconds Telegram may cache an answer
+DEBOUNCE = 0.3  # seconds to wait for the next keystroke before searching
+
+
+class InlineSearch(object):
+    """Answers to inline queries shared by all users.
+
+    Players and courts are searched in indexes prebuilt when roster and
+    locations are loaded, nothing is requested from msliga.ru per query.
+    Answers are serialized once and kept in LRU cache by normalized query.
+    """
+
+    def __init__(self, api, players, locations, limit=LIMIT, size=CACHE_SIZE):
+        """Init."""
+        super(InlineSearch, self).__init__()
+        self.api = api
+        self._players_cache = players
+        self._locations_cache = locations
+        self.limit = limit
+        self.size = size
+        self._answers = collections.OrderedDict()
+        self._locations = None
+        self._location_index = None
+
+    async def cached(self, query):
+        """Return serialized answer if the query is answered for current roster and locations."""
+        key = normalize(query)
+        answer = self._answers.get(key)
+        if answer is not None:
+            roster, locations, results = answer
+            if roster is await self._players_cache.get() and locations is await self._locations_cache.get():
+                self._answers.move_to_end(key)
+                return results
+        return None
+
+    def _location_search(self, locations):
+        if self._locations is not locations:
+            self._location_index = SearchIndex(locations)
+            self._locations = locations
+        return self._location_index
+
+    async def search(self, query):
+        """Return serialized list of InlineQueryResultArticle for the query."""
+        key = normalize(query)
+        roster = await self._players_cache.get()
+        locations = await self._locations_cache.get()
+        results = []
+        if key:
+            players = roster.search(query, limit=self.limit)
+            courts = self._location_search(locations).search(query, limit=self.limit)
+            found = sorted(
+                [(score, 0, name) for name, score in players] + [(score, 1, name) for name, score in courts],
+                key=lambda x: (-x[0], x[1], x[2])
+            )[:self.limit]
+            for _score, kind, name in found:
+                if kind == 0:
+                    results.append(self._player(roster, name))
+                else:
+                    results.append(self._court(locations, name))
+        results = json.dumps(results, ensure_ascii=False, separators=(',', ':'))
+        self._answers[key] = (roster, locations, results)
+        self._answers.move_to_end(key)
+        if len(self._answers) > self.size:
+            self._answers.popitem(last=False)
+        return results
+
+    def _player(self, roster, name):
+        league = roster.leagues[name]
+        return dict(
+            type='article',
+            id='p{}'.format(roster.ids[name]),
+            title=name,
+            description=_("Player of league #{}").format(league),
+            url=self.api.link_for_player(league, roster.ids[name]),
+            input_message_content=dict(message_text=name),
+        )
+
+    def _court(self, locations, title):
+        return dict(
+            type='article',
+            id='l{}'.format(locations[title]),
+            title=title,
+            description=_("Court"),
+            input_message_content=dict(message_text=title),
+        )
+
+
+class InlineSearchHandler(telepot.aio.helper.InlineUserHandler, telepot.aio.helper.AnswererMixin):
+    """Handler answering inline queries of one user.
+
+    Answerer cancels the search of the previous query of the user, so
+    queries typed quickly are answered only when typing pauses for DEBOUNCE
+    seconds, unless the answer is cached.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._search = kwargs.pop('search')
+        super(InlineSearchHandler, self).__init__(*args, **kwargs)
+
+    async def answer(self, query):
+        results = await self._search.cached(query)
+        if results is None:
+            await asyncio.sleep(DEBOUNCE)
+            results = await self._search.search(query)
+        return dict(results=results, cache_time=CACHE_TIME)
+
+    def on_inline_query(self, msg):
+        query_id, from_id, query = telepot.glance(msg, flavor='inline_query')
+        logger.debug("Inline query %s from %s: %s", query_id, from_id, query)
+        self.answerer.answer(msg, self.answer, query)
+
+    def on_chosen_inline_result(self, msg):
+        result_id, from_id, query = telepot.glance(msg, flavor='chosen_inline_result')
+        logger.debug("Inline result %s chosen by %s for %s", result_id, from_id, query)
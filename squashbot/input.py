@@ -1,43 +1,34 @@
 """Input handler for chat."""
+import asyncio
 import logging
+import time
 import telepot
-import enum
+import collections
 from squashbot.names import GAME_RESULTS
-from fuzzywuzzy import process
-from telepot.namedtuple import ReplyKeyboardMarkup, ReplyKeyboardRemove
-from datetime import datetime
+from squashbot.roster import Roster
+from squashbot.session import Game, GameInputStage, MSK
+from squashbot.keyboards import FAVORITE
+from squashbot.bulk import parse_games, publish_games, MAX_GAMES, EXAMPLE
 import pendulum
-import redis
-from squashbot.utils import previous_days, grouper, markdown_link, custom_xrange as time_range
-from kortovnet import KortovNet
-from telepot.exception import TelegramError
-import gettext
-import os
-
-MSK = 'Europe/Moscow'
-LOCALE = 'ru_RU'
+from squashbot.utils import markdown_link, split_lines, MAX_LENGTH
+from squashbot.auth import changed_members
+from squashbot.i18n import _
+from squashbot.metrics import STAGE_SECONDS, UPDATE_SECONDS, ERRORS, ABANDONED, ACTIVE_HANDLERS
+logger = logging.getLogger(__name__)
+
 CHAT_MEMBERS = ['left_chat_member', 'new_chat_member']
-TOP_LOCS=3
-TOP_PLAYERS=3
-
-pendulum.set_locale('ru')
-localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locale')
-translate = gettext.translation('squashbot', localedir, fallback=True)
-_ = translate.gettext
-
-GameInputStage = enum.Enum(
-    value='GameInputStage',
-    names=[
-        'start',
-        'date',
-        'time',
-        'location',
-        'first_player',
-        'second_player',
-        'result',
-        'confirmation'
-    ]
-)
+
+def parse_locations(data):
+    """Convert API location list to title -> id mapping sorted by title."""
+    return collections.OrderedDict(sorted((p['title'], p['id']) for p in data))
+
+
+def parse_players(data):
+    """Convert API player list to roster partitioned by league."""
+    return Roster(
+        ("{} {}".format(p['last_name'].strip(), p['first_name'].strip()), p['competitor_id'], p['league_id'])
+        for p in data
+    )
 
 
 class GameInputHandler(telepot.aio.helper.ChatHandler):
@@ -45,191 +36,289 @@ class GameInputHandler(telepot.aio.helper.ChatHandler):
 
     def __init__(self, *args, **kwargs):
         self._admin_chat = kwargs.pop('admin_chat', None)
+        self.api = kwargs.pop('api')
+        self._players_cache = kwargs.pop('players')
+        self._locations_cache = kwargs.pop('locations')
+        self._sessions = kwargs.pop('sessions')
+        self._favorites = kwargs.pop('favorites')
+        self._members = kwargs.pop('members')
+        self._publisher = kwargs.pop('publisher')
+        self._outbox = kwargs.pop('outbox')
+        self._announcer = kwargs.pop('announcer')
+        self._keyboards = kwargs.pop('keyboards')
+        self._inflight = kwargs.pop('inflight')
         super(GameInputHandler, self).__init__(*args, **kwargs)
+        self.roster = None
         self.players = None
         self.locations = None
-        self.api = KortovNet(token=os.getenv('LIGA_TOKEN'))
-        self.redis = redis.StrictRedis.from_url(os.getenv('REDIS_URL'))
-        self.league_group_id = os.getenv('LEAGUE_GROUP_ID')
-        self._stage = GameInputStage.start
-        self._league = None
-        # TODO: Create game class
-        self._location = None
-        self._time = None
-        self._player1 = None
-        self._player2 = None
-        self._result = None
-
-
-    def top_locations_for_user(self, user_id):
-        return [
-            "🔥" + x.decode()
-            for x in self.redis.zrevrange("loc:{}".format(user_id), 0, TOP_LOCS)
-        ]
+        self.game = None
+        self._saved = None
+        self._top = None
+        self._prefetched = {}
+        ACTIVE_HANDLERS.inc()
 
-    def top_players_for_user(self, user_id):
-        return [
-            x.decode()
-            for x in self.redis.zrevrange("ps:{}".format(user_id), 0, TOP_PLAYERS)
-        ]
+    def on_close(self, ex):
+        """Count the handler out and the game as abandoned if it is not finished."""
+        ACTIVE_HANDLERS.dec()
+        if self.game is not None and self.game.stage != GameInputStage.start:
+            reason = 'timeout' if isinstance(ex, telepot.exception.IdleTerminate) else 'error'
+            ABANDONED.labels(self.game.stage.name, reason).inc()
+        super(GameInputHandler, self).on_close(ex)
 
-    def get_location_keyboard_for_user(self, user_id):
-        top = self.top_locations_for_user(user_id)
-        names = None
-        
-        if len(top) == 0:
-            names = sorted(self.locations.keys())
-        else:
-            names = top + sorted([k for k in self.locations.keys() if k not in top])
-        
-        return ReplyKeyboardMarkup(
-            keyboard=grouper(names, 1),
-            one_time_keyboard=True
-        )
+    async def reply(self, text, **kwargs):
+        """Send message to the chat through the outbox."""
+        return await self._outbox.sendMessage(self.chat_id, text, **kwargs)
 
-    def get_players_keyboard_for_user(self, user_id, exclude=set()):
-        top = [p for p in self.top_players_for_user(user_id) if (p in self.players)]
-        names = None
-        if len(top) == 0:
-            names = sorted(self.players.keys())
-        else:
-            names = ["🔥" + x for x in top] + sorted([k for k in self.players.keys() if k not in top])
+    async def reply_lines(self, lines, **kwargs):
+        """Send lines in as few messages as Telegram allows, kwargs go with the last one."""
+        texts = split_lines(lines)
+        for text in texts[:-1]:
+            await self.reply(text)
+        return await self.reply(texts[-1], **kwargs)
+
+    def prefetch(self, user_id):
+        """Start loading everything the game input needs at once.
 
-        
-        return ReplyKeyboardMarkup(
-            keyboard=[[p] for p in names if p.replace("🔥", "") not in exclude],
-            one_time_keyboard=True
+        Stages await these tasks instead of waiting for the network one
+        after another, loaders are called again when a task is used up.
+        """
+        self._top = None
+        self._prefetched = dict(
+            authorized=asyncio.ensure_future(self.is_authorized(user_id)),
+            locations=asyncio.ensure_future(self._locations_cache.get()),
+            roster=asyncio.ensure_future(self._players_cache.get()),
+            favorites=asyncio.ensure_future(self._favorites.top(user_id)),
         )
-        
-        
-        
+        for task in self._prefetched.values():
+            task.add_done_callback(self._prefetch_done)
+
+    @staticmethod
+    def _prefetch_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Prefetching failed: %r", task.exception())
+
+    async def prefetched(self, name, load):
+        """Return result of the prefetched task or of calling load if there is none."""
+        task = self._prefetched.pop(name, None)
+        return await (task if task is not None else load())
+
+    async def load_favorites(self, user_id):
+        """Fetch favorite locations and players of the user once per game."""
+        if self._top is None:
+            self._top = await self.prefetched('favorites', lambda: self._favorites.top(user_id or self.chat_id))
+        return self._top
+
+    async def top_locations_for_user(self, user_id):
+        return (await self.load_favorites(user_id))[0]
+
+    async def top_players_for_user(self, user_id):
+        return (await self.load_favorites(user_id))[1]
+
+    async def get_location_keyboard_for_user(self, user_id):
+        top = await self.top_locations_for_user(user_id)
+        return self._keyboards.choices(self.locations, top)
+
+    async def get_players_keyboard_for_user(self, user_id, exclude=()):
+        top = [p for p in await self.top_players_for_user(user_id) if p in self.players]
+        return self._keyboards.choices(self.players, top, exclude)
+
+    async def load_players(self):
+        """Load roster limited to the league of the first player if it is chosen."""
+        self.roster = await self.prefetched('roster', self._players_cache.get)
+        self.players = self.roster if self.game.league is None else self.roster.league(self.game.league)
+
+    async def resume(self):
+        """Restore the game of the chat saved by this or another worker."""
+        self.game = await self._sessions.load(self.chat_id)
+        self._saved = self.game.dumps()
+        if self.game.stage != GameInputStage.start:
+            self.locations = await self._locations_cache.get()
+        if self.game.stage.value >= GameInputStage.first_player.value:
+            await self.load_players()
+
+    async def save(self):
+        """Persist the game if it is changed, otherwise keep it from expiring."""
+        dump = self.game.dumps()
+        if dump != self._saved:
+            await self._sessions.save(self.chat_id, self.game)
+            self._saved = dump
+        elif self.game.stage != GameInputStage.start:
+            await self._sessions.touch(self.chat_id)
 
     async def move_to(self, stage, keyboard=None, user_id=None):
         """Change state of chat to a specified stage."""
-        self._stage = stage
-        if self._stage == GameInputStage.location:
-            if not self.locations:
-                self.locations = {
-                    p['title']: p['id']
-                    for p in self.api.get_locations()
-                }
-            markup = self.get_location_keyboard_for_user(user_id)
-            await self.sender.sendMessage(
+        with STAGE_SECONDS.labels(stage.name).time():
+            await self._move_to(stage, keyboard, user_id)
+
+    async def _move_to(self, stage, keyboard=None, user_id=None):
+        self.game.stage = stage
+        if self.game.stage == GameInputStage.location:
+            self.locations = await self.prefetched('locations', self._locations_cache.get)
+            markup = await self.get_location_keyboard_for_user(user_id)
+            await self.reply(
                 _('Hi fellow squasher! Please choose the location of the game.'),
                 reply_markup=markup
             )
-        elif self._stage == GameInputStage.time:
-            time_strs = []
-            if self._time.is_today():
-                now = pendulum.now(tz=MSK)
-                # truncate to 5 minutes
-                now = now.replace(
-                    minute=now.minute - now.minute % 5
-                )
-                time_strs = [
-                    t.strftime('%H:%M')
-                    for t in time_range(
-                        now.subtract(hours=2) - now,
-                        unit='minutes',
-                        step=10
-                    )
-                ]
-            else:
-                period = self._time.end_of('day') - self._time
-                time_strs = [
-                    t.strftime('%H:%M')
-                    for t in period.range('minutes', 30)
-                ]
-            markup = ReplyKeyboardMarkup(
-                keyboard=grouper(
-                    time_strs,
-                    n=3
-                ),
-                one_time_keyboard=True
-            )
-            await self.sender.sendMessage(
+        elif self.game.stage == GameInputStage.time:
+            await self.reply(
                 _('You played on {date}.\nWhat time have the game ended?').format(
-                    date=self._time.format('LL', formatter='alternative')
+                    date=self.game.time.format('LL', formatter='alternative')
                 ),
-                reply_markup=markup
+                reply_markup=self._keyboards.times(self.game.time)
             )
-        elif self._stage == GameInputStage.date:
-            now = datetime.now()
-            dates = [
-                d.strftime('%d.%m.%y')
-                for d in previous_days(n=90)
-            ]
-            await self.sender.sendMessage(
-                 _("Courts are good at {}.\nWhen game is played? Let's start with date.").format(self._location),
-                 reply_markup=ReplyKeyboardMarkup(keyboard=grouper(reversed(dates), 1))
+        elif self.game.stage == GameInputStage.date:
+            await self.reply(
+                 _("Courts are good at {}.\nWhen game is played? Let's start with date.").format(self.game.location),
+                 reply_markup=self._keyboards.dates()
             )
-        elif self._stage == GameInputStage.first_player:
-            if not self.players:
-                self.players = {
-                    "{} {}".format(p['last_name'].strip(), p['first_name'].strip()):
-                        dict(id=p['competitor_id'], league_id=p['league_id'])
-                    for p in self.api.get_all_players(self.league_group_id)
-                }
-            print("Here", self.top_players_for_user(user_id))
-            await self.sender.sendMessage(
+        elif self.game.stage == GameInputStage.first_player:
+            self.game.league = None
+            await self.load_players()
+            await self.reply(
                 _("""Nice. The game is ended at {}.\nWho's the first player?""").format(
-                    self._time.diff_for_humans()
+                    self.game.time.diff_for_humans()
                 ),
-                reply_markup=self.get_players_keyboard_for_user(user_id)
+                reply_markup=await self.get_players_keyboard_for_user(user_id)
             )
-        elif self._stage == GameInputStage.second_player:
-            await self.sender.sendMessage(
-                _("""Well done. We like {}.\nWho was his mathup?""").format(self._player1),
-                reply_markup=self.get_players_keyboard_for_user(
+        elif self.game.stage == GameInputStage.second_player:
+            await self.reply(
+                _("""Well done. We like {}.\nWho was his mathup?""").format(self.game.player1),
+                reply_markup=await self.get_players_keyboard_for_user(
                     user_id,
-                    exclude=[self._player1]
+                    exclude=[self.game.player1]
                 )
             )
-        elif self._stage == GameInputStage.result:
-            await self.sender.sendMessage(
-                _("""Well done.\nAnd the result of {} - {} is?""").format(self._player1, self._player2),
-                reply_markup=ReplyKeyboardMarkup(keyboard=grouper(GAME_RESULTS, 2), one_time_keyboard=True)
+        elif self.game.stage == GameInputStage.result:
+            await self.reply(
+                _("""Well done.\nAnd the result of {} - {} is?""").format(self.game.player1, self.game.player2),
+                reply_markup=self._keyboards.results
+            )
+        elif self.game.stage == GameInputStage.bulk:
+            self.game.bulk = None
+            await self.reply(
+                _("""Send games one per line like\n{}""").format(EXAMPLE),
+                reply_markup=self._keyboards.remove
             )
-        elif self._stage == GameInputStage.confirmation:
-            await self.sender.sendMessage(
+        elif self.game.stage == GameInputStage.confirmation:
+            await self.reply(
                 _("""Let's check.\n{} {}\n{} - {} {}.""").format(
-                    self._location,
-                    self._time.format('%d.%m.%y %H:%M'),
-                    self._player1,
-                    self._player2,
-                    self._result
+                    self.game.location,
+                    self.game.time.format('%d.%m.%y %H:%M'),
+                    self.game.player1,
+                    self.game.player2,
+                    self.game.result
                 ),
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=grouper(['OK', '/back'], 1),
-                    one_time_keyboard=True
-                )
+                reply_markup=self._keyboards.confirmation
+            )
+
+    @staticmethod
+    def author(msg):
+        """Return name of the message sender for announcements."""
+        from_data = msg['from']
+        name = "@{}".format(from_data['username']) if 'username' in from_data else from_data['first_name']
+        return name.replace('_', '\_')
+
+    async def load_bulk(self, text):
+        """Parse games sent with /bulk against current roster and locations."""
+        self.locations = await self._locations_cache.get()
+        await self.load_players()
+        return parse_games(text, self.players, self.locations)
+
+    async def check_bulk(self, text):
+        """Validate games sent with /bulk and ask to confirm all of them at once."""
+        games = await self.load_bulk(text)
+        if not games:
+            await self.move_to(GameInputStage.bulk)
+        elif len(games) > MAX_GAMES:
+            await self.reply(_("""Too many games, send at most {} at once.""").format(MAX_GAMES))
+        elif any(game.error for game in games):
+            await self.reply_lines(
+                [_("""Please fix these lines and send all games again.""")] + [
+                    "{}. {}\n{}".format(game.number, game.line, game.error) for game in games if game.error
+                ]
+            )
+        else:
+            self.game.bulk = text
+            await self.reply_lines(
+                [_("""Let's check {} games.""").format(len(games))] +
+                ["{}. {}".format(game.number, game.title()) for game in games],
+                reply_markup=self._keyboards.confirmation
             )
 
+    async def publish_bulk(self, msg):
+        """Publish confirmed games concurrently and report status of every line."""
+        games = await self.load_bulk(self.game.bulk)
+        if any(game.error for game in games):
+            await self.check_bulk(self.game.bulk)
+            return
+        errors = await publish_games(self._publisher, self.chat_id, games, self.players, self.locations)
+        report = [
+            "{}. {} {}".format(game.number, "❌" if error else "✅", game.title())
+            for game, error in zip(games, errors)
+        ]
+        failed = sum(1 for error in errors if error)
+        if failed:
+            report.append(_("""{} games are not published, please send them again later.""").format(failed))
+        # the games are published, so failing to report them mustn't publish them again
+        self.game = Game()
+
+        published = [game for game, error in zip(games, errors) if not error]
+        if published:
+            lines = [
+                "{p1} - {p2} {result} {loc} {time}".format(
+                    p1=markdown_link(game.player1, self.api.link_for_player(
+                        self.players.leagues[game.player1], self.players.ids[game.player1])),
+                    p2=markdown_link(game.player2, self.api.link_for_player(
+                        self.players.leagues[game.player2], self.players.ids[game.player2])),
+                    result=game.result,
+                    loc=game.location,
+                    time=game.time.format('%d/%m %H:%M')
+                )
+                for game in published
+            ]
+            tag = _("""#result by {author}""").format(author=self.author(msg))
+            for text in split_lines(lines, MAX_LENGTH - len(tag) - 1):
+                self._announcer.announce(self._admin_chat, text + "\n" + tag)
+        await self.reply_lines(report, reply_markup=self._keyboards.remove)
+
     async def is_authorized(self, user_id):
         """Check that user in the league group."""
-        # TODO: add redis caching
-        try:
-            res = await self.bot.getChatMember(self._admin_chat, user_id)
-        except TelegramError as ex:
-            logging.exception(ex)
-            return False
-        return (res['status'] in ('creator', 'administrator', 'member')) or (res['status'] == 'left')
+        return await self._members.is_member(self.bot, user_id)
 
     async def on_chat_message(self, msg):
+        """Handle chat message within the persisted game of the chat."""
+        started = time.monotonic()
+        stage = 'unknown'
+        try:
+            with self._inflight:
+                if self.game is None:
+                    await self.resume()
+                stage = self.game.stage.name
+                try:
+                    await self.handle_message(msg)
+                finally:
+                    await self.save()
+        except Exception:
+            ERRORS.labels('handler').inc()
+            raise
+        finally:
+            UPDATE_SECONDS.labels(stage).observe(time.monotonic() - started)
+
+    async def handle_message(self, msg):
         """Handle chat message."""
-        logging.debug(msg)
         content_type, chat_type, chat_id = telepot.glance(msg)
-
-        logging.debug(content_type)
+        logger.debug("Received %s message %s", content_type, msg)
 
         if chat_type != 'private':
             if content_type not in CHAT_MEMBERS:
-                await self.sender.sendMessage(_("Sorry, I work only in private chats."))
+                await self.reply(_("Sorry, I work only in private chats."))
+            elif chat_id == self._admin_chat:
+                await self._members.invalidate(*changed_members(msg))
             return
 
         if content_type != 'text':
             if content_type not in CHAT_MEMBERS:
-                await self.sender.sendMessage(_("Sorry, I don't understand only text."))
+                await self.reply(_("Sorry, I don't understand only text."))
             return
 
         user_id = msg['from']['id']
@@ -238,166 +327,181 @@ class GameInputHandler(telepot.aio.helper.ChatHandler):
 
         if text[0] == '/':
             # hadling commands
-            command = text.strip().lower()
-            if command == '/newgame':
-                is_authorized = await self.is_authorized(user_id)
+            command, rest = (text.strip().split(None, 1) + [''])[:2]
+            command = command.lower()
+            if command == '/bulk':
+                if not await self.is_authorized(user_id):
+                    await self.reply(
+                        _('Sorry, bro, but you are not a member of the league chat.')
+                    )
+                elif self.game.stage not in (GameInputStage.start, GameInputStage.bulk):
+                    await self.reply(
+                        _('You are already in process of entering the results!')
+                    )
+                elif rest.strip():
+                    self.game.stage = GameInputStage.bulk
+                    await self.check_bulk(rest)
+                else:
+                    await self.move_to(GameInputStage.bulk)
+            elif command == '/newgame':
+                if self.game.stage == GameInputStage.start:
+                    self.prefetch(user_id)
+                is_authorized = await self.prefetched('authorized', lambda: self.is_authorized(user_id))
                 if is_authorized:
-                    if self._stage == GameInputStage.start:
+                    if self.game.stage == GameInputStage.start:
                             await self.move_to(GameInputStage.location, user_id=user_id)
                     else:
-                        await self.sender.sendMessage(
+                        await self.reply(
                             _('You are already in process of entering the results!')
                         )
                 else:
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _('Sorry, bro, but you are not a member of the league chat.')
                     )
             elif command == '/cancel':
-                if self._stage == GameInputStage.start:
-                    await self.sender.sendMessage(
+                if self.game.stage == GameInputStage.start:
+                    await self.reply(
                         _("Nothing to cancel. You don't even started")
                     )
                 else:
-                    self._stage = GameInputStage.start
-                    await self.sender.sendMessage(
+                    ABANDONED.labels(self.game.stage.name, 'cancel').inc()
+                    self.game = Game()
+                    await self.reply(
                         _("Ok. Full Reset! Start enter new game with /newgame")
                     )
             elif command == '/back':
-                if self._stage != GameInputStage.start:
-                    await self.move_to(GameInputStage(self._stage.value - 1))
+                if self.game.stage == GameInputStage.bulk:
+                    await self.move_to(GameInputStage.bulk)
+                elif self.game.stage != GameInputStage.start:
+                    await self.move_to(GameInputStage(self.game.stage.value - 1))
                 else:
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _("Oh, we can't go back darling. We've just started... Do you mean /cancel?")
                     )
         else:
             # Basic messages
-            if self._stage == GameInputStage.location:
-                text = text.strip().replace("🔥", "")
+            if self.game.stage == GameInputStage.location:
+                text = text.strip().replace(FAVORITE, "")
                 if text in self.locations:
-                    self._location = text
-                    self.redis.zadd("loc:{}".format(user_id), 1, text)
+                    self.game.location = text
+                    await self._favorites.add_location(user_id, text)
                     await self.move_to(GameInputStage.date)
                 else:
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _("""Sorry, I don't know about this place.
                         If this place is new, please contact administrators to add this court to our list.""")
                     )
-            elif self._stage == GameInputStage.date:
+            elif self.game.stage == GameInputStage.date:
                 text = text.strip()
                 try:
                     time = pendulum.from_format(text, "%d.%m.%y", MSK)
                 except ValueError as ex:
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _("""Sorry, I cannot recognize the date. You can input custom date in 12.12.12 format""")
                     )
                 else:
                     if time.is_future():
-                        await self.sender.sendMessage(
+                        await self.reply(
                             _("""Looks like your game is in the future! No time travelers allowed!""")
                         )
                     else:
-                        self._time = time
+                        self.game.time = time
                         await self.move_to(GameInputStage.time)
-            elif self._stage == GameInputStage.time:
+            elif self.game.stage == GameInputStage.time:
                 text = text.strip()
                 try:
                     time = pendulum.from_format(text, "%H:%M", MSK)
                 except ValueError as ex:
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _("""Sorry, I cannot recognize time. Please post something like 15:45 or 24.10.2016 13:20.""")
                     )
                 else:
-                    time = pendulum.combine(self._time, time.time()).timezone_(MSK)
+                    time = pendulum.combine(self.game.time, time.time()).timezone_(MSK)
                     if time.is_future():
-                        await self.sender.sendMessage(
+                        await self.reply(
                             _("""Looks like your game is in the future! No time travelers allowed!""")
                         )
                     else:
-                        self._time = time
+                        self.game.time = time
                         await self.move_to(GameInputStage.first_player, user_id=user_id)
-            elif self._stage == GameInputStage.first_player:
-                text = text.strip().replace("🔥", "")
+            elif self.game.stage == GameInputStage.first_player:
+                text = text.strip().replace(FAVORITE, "")
                 if text not in self.players:
-                    ps = process.extract(text, self.players.keys(), limit=10)
-                    await self.sender.sendMessage(
+                    ps = self.players.search(text, limit=10)
+                    await self.reply(
                         _("""I don't know that man!!! I suggested some names for you below"""),
-                        reply_markup=ReplyKeyboardMarkup(keyboard=[
-                            [p] for p, _ in ps if p != self._player1
-                         ], one_time_keyboard=True)
+                        reply_markup=self._keyboards.suggestions([p for p, _ in ps if p != self.game.player1])
                     )
                 else:
-                    self._player1 = text
-                    self._league = self.players[self._player1]['league_id']
-                    self.players = {k: v for k, v in self.players.items() if v['league_id'] == self._league}
-                    self.redis.zadd("ps:{}".format(user_id), 1, text)
+                    self.game.player1 = text
+                    self.game.league = self.players.leagues[self.game.player1]
+                    self.players = self.roster.league(self.game.league)
                     await self.move_to(GameInputStage.second_player, user_id=user_id)
-            elif self._stage == GameInputStage.second_player:
-                text = text.strip().replace("🔥", "")
-                if (text not in self.players) or (text == self._player1):
-                    ps = process.extract(text, self.players.keys(), limit=10)
-                    await self.sender.sendMessage(
+            elif self.game.stage == GameInputStage.second_player:
+                text = text.strip().replace(FAVORITE, "")
+                if (text not in self.players) or (text == self.game.player1):
+                    ps = self.players.search(text, limit=10)
+                    await self.reply(
                         _("""I don't know that man!!! I suggested some names for you below"""),
-                        reply_markup=ReplyKeyboardMarkup(keyboard=[
-                            [p] for p, _ in ps if p != self._player1
-                         ], one_time_keyboard=True)
+                        reply_markup=self._keyboards.suggestions([p for p, _ in ps if p != self.game.player1])
                     )
                 else:
-                    self._player2 = text
-                    self.redis.zadd("ps:{}".format(user_id), 1, text)
+                    self.game.player2 = text
+                    await self._favorites.add_players(user_id, self.game.player1, self.game.player2)
                     await self.move_to(GameInputStage.result)
-            elif self._stage == GameInputStage.result:
+            elif self.game.stage == GameInputStage.result:
                 text = text.strip()
 
                 if (text not in GAME_RESULTS):
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _("""Strange result! Try something look like 3:1.""")
                     )
                 else:
-                    self._result = text
+                    self.game.result = text
                     await self.move_to(GameInputStage.confirmation)
-            elif self._stage == GameInputStage.confirmation:
+            elif self.game.stage == GameInputStage.bulk:
+                if self.game.bulk is not None and text.strip().lower() == 'ok':
+                    await self.publish_bulk(msg)
+                else:
+                    await self.check_bulk(text)
+            elif self.game.stage == GameInputStage.confirmation:
                 text = text.strip().lower()
                 if text != 'ok':
-                    await self.sender.sendMessage(
+                    await self.reply(
                         _("""Please confirm the result!""")
                     )
                 else:
-                    await self.sender.sendMessage(
-                        _("""Well done! We'll notify everyone about the game!\nEnter new game with /newgame."""),
-                        reply_markup=ReplyKeyboardRemove()
-                    )
-                    from_data = msg['from']
-                    name =\
-                        "@{}".format(from_data['username']) if 'username' in from_data else from_data['first_name']
-                    r1, r2 = [int(x) for x in self._result.split(':')]
+                    r1, r2 = [int(x) for x in self.game.result.split(':')]
                     data = dict(
-                        lg=self._league,
-                        p1=self.players[self._player1]['id'],
-                        p2=self.players[self._player2]['id'],
+                        lg=self.game.league,
+                        p1=self.players.ids[self.game.player1],
+                        p2=self.players.ids[self.game.player2],
                         r1=r1,
                         r2=r2,
-                        loc=self.locations[self._location],
-                        time=self._time.to_atom_string()
+                        loc=self.locations[self.game.location],
+                        time=self.game.time.to_atom_string()
                     )
-                    logging.debug(data)
-                    result = self.api.publish_result(**data)
-                    logging.debug(result)
-                    await self.bot.sendMessage(
+                    logger.debug("Publishing game %s", data)
+                    await self._publisher.enqueue(self.chat_id, data)
+                    await self.reply(
+                        _("""Well done! We'll notify everyone about the game!\nEnter new game with /newgame."""),
+                        reply_markup=self._keyboards.remove
+                    )
+                    self._announcer.announce(
                         self._admin_chat,
                         _("""{p1} - {p2}\n{result} {loc} {time}\n#result by {author}""").format(
-                            author=name.replace('_', '\_'),
-                            loc=self._location,
-                            time=self._time.format('%d/%m %H:%M'),
+                            author=self.author(msg),
+                            loc=self.game.location,
+                            time=self.game.time.format('%d/%m %H:%M'),
                             p1=markdown_link(
-                                title=self._player1,
-                                url=self.api.link_for_player(self._league, self.players[self._player1]['id'])
+                                title=self.game.player1,
+                                url=self.api.link_for_player(self.game.league, self.players.ids[self.game.player1])
                             ),
                             p2=markdown_link(
-                                title=self._player2,
-                                url=self.api.link_for_player(self._league, self.players[self._player2]['id'])
+                                title=self.game.player2,
+                                url=self.api.link_for_player(self.game.league, self.players.ids[self.game.player2])
                             ),
-                            result=self._result
-                        ),
-                        parse_mode='Markdown'
+                            result=self.game.result
+                        )
                     )
-                    self._stage = GameInputStage.start
+                    self.game = Game()
@@ -0,0 +1,117 @@
+"""Reply keyboards shared by all chat handlers."""
+import collections
+import json
+import pendulum
+from squashbot.names import GAME_RESULTS
+from squashbot.session import MSK
+from squashbot.utils import previous_days, grouper, custom_xrange as time_range
+
+FAVORITE = "🔥"
+DAYS = 90  # days offered on the date keyboard
+BUCKET = 5  # minutes, today's time keyboard is rebuilt this often
+CACHE_SIZE = 16
+
+
+def markup(rows, one_time_keyboard=True):
+    """Return ReplyKeyboardMarkup JSON made of already serialized rows.
+
+    telepot passes string reply_markup to Telegram as is.
+    """
+    return '{{"keyboard":[{}]{}}}'.format(
+        ','.join(rows),
+        ',"one_time_keyboard":true' if one_time_keyboard else ''
+    )
+
+
+def row(*buttons):
+    return json.dumps(buttons, separators=(',', ':'))
+
+
+class KeyboardCache(object):
+    """Serialized keyboards built once and reused by every handler.
+
+    Date and time grids are keyed by day and 5 minute bucket. Rows of
+    location and player lists are serialized once per list, so only
+    favorites of the user are merged in on each request. Lists are expected
+    to be ordered already, see parse_locations and parse_players.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        """Init."""
+        super(KeyboardCache, self).__init__()
+        self.size = size
+        self._grids = collections.OrderedDict()
+        self._rows = collections.OrderedDict()
+        self.results = markup([row(*r) for r in grouper(GAME_RESULTS, 2)])
+        self.confirmation = markup([row('OK'), row('/back')])
+        self.remove = '{"remove_keyboard":true}'
+
+    def _memo(self, cache, key, build):
+        try:
+            cache.move_to_end(key)
+            return cache[key]
+        except KeyError:
+            value = cache[key] = build()
+            if len(cache) > self.size:
+                cache.popitem(last=False)
+            return value
+
+    def dates(self):
+        """Return keyboard of previous days starting from today."""
+        today = pendulum.today()
+
+        def build():
+            dates = [d.strftime('%d.%m.%y') for d in previous_days(n=DAYS, before=today)]
+            return markup([row(d) for d in reversed(dates)], one_time_keyboard=False)
+
+        return self._memo(self._grids, ('dates', today.to_date_string()), build)
+
+    def times(self, time):
+        """Return keyboard of times of the game played at specified day."""
+        if time.is_today():
+            now = pendulum.now(tz=MSK)
+            # truncate to 5 minutes
+            now = now.replace(minute=now.minute - now.minute % BUCKET, second=0, microsecond=0)
+            key = ('today', now.strftime('%Y-%m-%d %H:%M'))
+
+            def times():
+                return time_range(now.subtract(hours=2) - now, unit='minutes', step=10)
+        else:
+            key = ('day', time.strftime('%H:%M'))
+
+            def times():
+                return (time.end_of('day') - time).range('minutes', 30)
+
+        def build():
+            return markup([row(*r) for r in grouper([t.strftime('%H:%M') for t in times()], n=3)])
+
+        return self._memo(self._grids, key, build)
+
+    def _names(self, names):
+        """Return names with their serialized rows, built once per list.
+
+        Rosters keep their rows themselves, other lists like locations are
+        cached here.
+        """
+        if hasattr(names, 'rows'):
+            return names.rows
+        cached = self._rows.get(id(names))
+        if cached is None or cached[0] is not names:
+            cached = (names, [(name, row(name)) for name in names])
+            self._rows[id(names)] = cached
+            if len(self._rows) > self.size:
+                self._rows.popitem(last=False)
+        else:
+            self._rows.move_to_end(id(names))
+        return cached[1]
+
+    def suggestions(self, names):
+        """Return keyboard of names found for the user, it is not reused."""
+        return markup([row(name) for name in names])
+
+    def choices(self, names, top=(), exclude=()):
+        """Return keyboard of names with favorites of the user first."""
+        skip = set(top) | set(exclude)
+        rows = [row(FAVORITE + name) for name in top if name not in exclude]
+        rows.extend(r for name, r in self._names(names) if name not in skip)
+        return markup(rows)
@@ -0,0 +1,122 @@
+"""Logging which doesn't block the event loop."""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+QUEUE_SIZE = 10000  # records waiting for the writer, new ones are dropped above it
+BATCH_SIZE = 500  # records written at once
+
+
+class JsonFormatter(logging.Formatter):
+    """Format record as a single line json object."""
+
+    def format(self, record):
+        data = dict(
+            time=self.formatTime(record),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+            location="{}:{}".format(record.filename, record.lineno),
+        )
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=repr)
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + \
+            '.{:03d}Z'.format(int(record.msecs))
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Put records to the queue without formatting and without waiting.
+
+    Message is formatted by the writer thread, so arguments of log calls
+    must not be changed after the call. Records are dropped when the
+    queue is full.
+    """
+
+    def __init__(self, queue):
+        """Init."""
+        super(QueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueWriter(object):
+    """Background thread writing queued records to the stream in batches."""
+
+    def __init__(self, handler, stream=None, formatter=None, batch_size=BATCH_SIZE):
+        """Init."""
+        super(QueueWriter, self).__init__()
+        self.handler = handler
+        self.stream = stream or sys.stderr
+        self.formatter = formatter or logging.Formatter()
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write queued records and stop."""
+        if self._thread is not None:
+            self.handler.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _format(self, record):
+        try:
+            return self.formatter.format(record)
+        except Exception:
+            return "Logging record {!r} failed: {!r}".format(record.msg, sys.exc_info()[1])
+
+    def _run(self):
+        records = self.handler.queue
+        stopped = False
+        while not stopped:
+            batch = [records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch = [r for r in batch if r is not None]
+            lines = [self._format(record) for record in batch]
+            if self.handler.dropped:
+                dropped, self.handler.dropped = self.handler.dropped, 0
+                lines.append(self._format(logging.makeLogRecord(dict(
+                    name=__name__, levelno=logging.WARNING, levelname='WARNING',
+                    msg="%s log records dropped, queue is full.", args=(dropped,)
+                ))))
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except Exception:
+                pass
+
+
+def parse_levels(value):
+    """Parse levels of loggers like 'aioredis=WARNING,squashbot.input=INFO'."""
+    levels = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            name, _, level = item.partition('=')
+            levels[name.strip()] = level.strip().upper()
+    return levels
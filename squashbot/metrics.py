@@ -0,0 +1,346 @@
+"""Process metrics exposed in Prometheus text format."""
+import collections
+import logging
+import math
+import re
+import sys
+import threading
+import time
+import traceback
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+PROFILE_INTERVAL = 0.01  # seconds between stack samples
+PROFILE_DEPTH = 30  # innermost frames kept in a sample
+PROFILE_TOP = 20  # stacks dumped
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Registry(object):
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        """Init."""
+        super(Registry, self).__init__()
+        self.metrics = collections.OrderedDict()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric {} is already registered".format(metric.name))
+        self.metrics[metric.name] = metric
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    """Metric with optional labels, children are created on first use."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        """Init."""
+        super(Metric, self).__init__()
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Return child metric for label values."""
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.label_names):
+            raise ValueError("Expected labels {}".format(self.label_names))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def _default(self):
+        if self.label_names:
+            raise ValueError("Labels {} are not specified".format(self.label_names))
+        return self.labels()
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            for suffix, labels, value in child.samples():
+                yield '{}{}{} {}'.format(
+                    self.name,
+                    suffix,
+                    _format_labels(self.label_names + labels[0], values + labels[1]),
+                    _format_value(value)
+                )
+
+
+class _CounterChild(object):
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield '', ((), ()), self.value
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+    _child = _CounterChild
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(Metric):
+    """Value going up and down."""
+
+    kind = 'gauge'
+    _child = _GaugeChild
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _Timer(object):
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.monotonic() - self.started)
+
+
+class _HistogramChild(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self):
+        """Return context manager observing time spent in it."""
+        return _Timer(self)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '_bucket', (('le',), (_format_value(bound),)), cumulative
+        yield '_bucket', (('le',), ('+Inf',)), self.count
+        yield '_sum', ((), ()), self.sum
+        yield '_count', ((), ()), self.count
+
+
+class Histogram(Metric):
+    """Distribution of observed values, usually durations in seconds."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS, registry=REGISTRY):
+        """Init."""
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labels, registry)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+STAGE_SECONDS = Histogram(
+    'squashbot_stage_seconds', "Time of moving the game to the stage.", ['stage'])
+UPDATE_SECONDS = Histogram(
+    'squashbot_update_seconds', "Time of handling chat message by the stage it was received at.", ['stage'])
+API_SECONDS = Histogram(
+    'squashbot_api_seconds', "Duration of msliga.ru API calls.", ['method', 'endpoint'])
+REDIS_SECONDS = Histogram(
+    'squashbot_redis_seconds', "Duration of Redis commands.", ['command'])
+TELEGRAM_SECONDS = Histogram(
+    'squashbot_telegram_seconds', "Duration of Telegram Bot API calls.", ['method'])
+ERRORS = Counter(
+    'squashbot_errors_total', "Errors by the place they happened at.", ['where'])
+ABANDONED = Counter(
+    'squashbot_abandoned_sessions_total', "Games left before confirmation.", ['stage', 'reason'])
+ACTIVE_HANDLERS = Gauge(
+    'squashbot_active_handlers', "Chat handlers alive in the process.")
+
+
+def api_trace_config():
+    """Return aiohttp trace config recording API_SECONDS and API errors."""
+    def endpoint(url):
+        # ids are replaced to keep number of label values small
+        return re.sub(r'/\d+', '/{id}', url.path)
+
+    async def on_start(session, context, params):
+        context.started = time.monotonic()
+
+    async def on_end(session, context, params):
+        API_SECONDS.labels(params.method, endpoint(params.url)).observe(time.monotonic() - context.started)
+
+    async def on_exception(session, context, params):
+        API_SECONDS.labels(params.method, endpoint(params.url)).observe(time.monotonic() - context.started)
+        ERRORS.labels('api').inc()
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_start)
+    config.on_request_end.append(on_end)
+    config.on_request_exception.append(on_exception)
+    return config
+
+
+class Profiler(object):
+    """Sampling profiler of the thread running the event loop.
+
+    Background thread takes stack of the thread every interval seconds and
+    counts identical stacks, the hottest ones are returned by dump().
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, thread_id=None):
+        """Init."""
+        super(Profiler, self).__init__()
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = tuple(
+                '{}:{}:{}'.format(f.f_code.co_filename, f.f_lineno, f.f_code.co_name)
+                for f, _ in traceback.walk_stack(frame)
+            )[:PROFILE_DEPTH]
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def dump(self, top=PROFILE_TOP):
+        """Return the hottest stacks, innermost frame first."""
+        lines = ["{} samples every {}s".format(self.samples, self.interval)]
+        for stack, count in self.stacks.most_common(top):
+            lines.append('')
+            lines.append("{:.1f}% ({})".format(100.0 * count / max(self.samples, 1), count))
+            lines.extend('  ' + frame for frame in stack)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """Local HTTP server exposing /metrics and, with profiler, /profile."""
+
+    def __init__(self, host='127.0.0.1', port=9090, registry=REGISTRY, profiler=None):
+        """Init."""
+        super(MetricsServer, self).__init__()
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.profiler = profiler
+        self._runner = None
+
+    async def metrics(self, request):
+        from aiohttp import web
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def profile(self, request):
+        from aiohttp import web
+        if self.profiler is None:
+            return web.Response(status=404, text="Profiler is not enabled.")
+        return web.Response(text=self.profiler.dump(int(request.query.get('top', PROFILE_TOP))))
+
+    async def start(self):
+        # aiohttp.web takes a noticeable part of startup and is needed only with METRICS_PORT
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self.metrics)
+        app.router.add_get('/profile', self.profile)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if self.profiler is not None:
+            self.profiler.start()
+        logger.info("Metrics are served on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            logger.info("Hottest stacks:\n%s", self.profiler.dump())
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
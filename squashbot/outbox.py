@@ -0,0 +1,230 @@
+"""Scheduler of outgoing Telegram requests."""
+import asyncio
+import itertools
+import logging
+import time
+from telepot.exception import TooManyRequestsError
+from squashbot.metrics import TELEGRAM_SECONDS, ERRORS
+
+logger = logging.getLogger(__name__)
+
+REPLY = 0  # priority of replies to users
+ANNOUNCEMENT = 1  # priority of posts to the admin chat
+
+RATE = 30  # messages per second for the whole bot
+CHAT_RATE = 1  # messages per second to the same private chat
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60  # messages per second to the same group chat
+GROUP_BURST = 3
+RETRY_AFTER = 5  # seconds to wait when Telegram doesn't say how long
+MAX_BUCKETS = 10000  # idle chat buckets are dropped above this number
+# methods called with (chat_id, message_id) identifier and message_id as the first argument
+EDIT_METHODS = {'editMessageText', 'editMessageReplyMarkup', 'deleteMessage'}
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter."""
+
+    def __init__(self, rate, capacity):
+        """Init."""
+        super(TokenBucket, self).__init__()
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _fill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Return seconds until token is available."""
+        self._fill(now)
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+
+    def take(self, now):
+        self._fill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        """Don't give tokens for specified time."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class Request(object):
+    __slots__ = ('priority', 'seq', 'chat_id', 'method', 'args', 'kwargs', 'future')
+
+    def __init__(self, priority, seq, chat_id, method, args, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+    @property
+    def key(self):
+        return (self.chat_id, repr((self.method, self.args, sorted(self.kwargs.items()))))
+
+
+class Outbox(object):
+    """Central scheduler of messages sent by all handlers.
+
+    Requests are sent in order of priority while respecting global and per
+    chat token buckets, so replies to users overtake admin chat posts. At
+    most one request per chat is in flight to keep the order of messages.
+    When Telegram answers 429 the chat is paused for retry_after seconds and
+    the request is retried. Identical requests waiting for the same chat are
+    coalesced into one.
+    """
+
+    def __init__(self, bot=None, rate=RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 group_rate=GROUP_RATE, group_burst=GROUP_BURST):
+        """Init."""
+        super(Outbox, self).__init__()
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self._global = TokenBucket(rate, max(rate, 1))
+        self._buckets = {}
+        self._queue = []
+        self._pending = {}
+        self._busy = set()
+        self._inflight = set()
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def _bucket(self, chat_id):
+        if chat_id not in self._buckets:
+            if len(self._buckets) > MAX_BUCKETS:
+                self._prune()
+            if chat_id < 0:
+                self._buckets[chat_id] = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self._buckets[chat_id]
+
+    def _prune(self):
+        now = time.monotonic()
+        waiting = {request.chat_id for request in self._queue} | self._busy
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in waiting and bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[chat_id]
+
+    def post(self, chat_id, method, *args, priority=REPLY, **kwargs):
+        """Schedule bot method call for the chat and return future of its result."""
+        request = Request(priority, next(self._seq), chat_id, method, args, kwargs, None)
+        same = self._pending.get(request.key)
+        if same is not None:
+            return same.future
+        request.future = asyncio.get_event_loop().create_future()
+        request.future.add_done_callback(self._retrieve)
+        self._enqueue(request)
+        return request.future
+
+    async def send(self, chat_id, method, *args, priority=REPLY, **kwargs):
+        """Call bot method for the chat when rate limits allow it."""
+        return await self.post(chat_id, method, *args, priority=priority, **kwargs)
+
+    async def sendMessage(self, chat_id, text, priority=REPLY, **kwargs):
+        return await self.send(chat_id, 'sendMessage', text, priority=priority, **kwargs)
+
+    def _retrieve(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Sending message failed: %r", future.exception())
+
+    def _enqueue(self, request):
+        self._queue.append(request)
+        self._queue.sort(key=lambda r: (r.priority, r.seq))
+        self._pending[request.key] = request
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Start sending scheduled requests."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self, timeout=None):
+        """Send scheduled requests and stop."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while (self._queue or self._inflight) and (deadline is None or time.monotonic() < deadline):
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        await asyncio.wait([self._task])
+        self._task = None
+        if self._queue:
+            logger.warning("%s scheduled messages are not sent.", len(self._queue))
+        for request in self._queue:
+            request.future.cancel()
+        self._queue = []
+
+    async def run(self):
+        """Send scheduled requests as soon as limits allow."""
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = None
+            global_delay = self._global.delay(now)
+            for request in self._queue:
+                if request.chat_id in self._busy:
+                    continue
+                delay = max(global_delay, self._bucket(request.chat_id).delay(now))
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                self._queue.remove(request)
+                self._dispatch(request, now)
+                wait = 0
+                break
+            if wait == 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, request, now):
+        self._global.take(now)
+        self._bucket(request.chat_id).take(now)
+        self._busy.add(request.chat_id)
+        task = asyncio.ensure_future(self._call(request))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _call(self, request):
+        try:
+            args = (request.chat_id,) + request.args
+            if request.method in EDIT_METHODS:
+                args = ((request.chat_id, request.args[0]),) + request.args[1:]
+            with TELEGRAM_SECONDS.labels(request.method).time():
+                result = await getattr(self.bot, request.method)(*args, **request.kwargs)
+        except TooManyRequestsError as ex:
+            ERRORS.labels('telegram_429').inc()
+            retry_after = (ex.json or {}).get('parameters', {}).get('retry_after', RETRY_AFTER)
+            logger.warning("Too many requests to chat %s, retry after %ss.", request.chat_id, retry_after)
+            self._bucket(request.chat_id).block(time.monotonic(), retry_after)
+            self._busy.discard(request.chat_id)
+            self._enqueue(request)
+            return
+        except Exception as ex:
+            ERRORS.labels('telegram').inc()
+            self._finish(request)
+            request.future.set_exception(ex)
+        else:
+            self._finish(request)
+            request.future.set_result(result)
+
+    def _finish(self, request):
+        self._busy.discard(request.chat_id)
+        if self._pending.get(request.key) is request:
+            del self._pending[request.key]
+        if self._wakeup is not None:
+            self._wakeup.set()
@@ -0,0 +1,248 @@
+"""Durable write-behind queue of confirmed games."""
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import aiohttp
+from aioredis.errors import ReplyError
+from squashbot.bulk import idempotency_key
+from squashbot.metrics import ERRORS
+from squashbot.shutdown import Deadline
+
+logger = logging.getLogger(__name__)
+
+STREAM = 'games'
+GROUP = 'publishers'
+CONCURRENCY = 4  # games published simultaneously
+MAX_ATTEMPTS = 10  # attempts before game is moved to dead letter stream
+BASE_DELAY = 1  # seconds before first retry, doubled on every attempt
+MAX_DELAY = 5 * 60
+CLAIM_AFTER = 5 * 60  # seconds after which games of dead consumers are taken
+PUBLISHED_TTL = 7 * 24 * 60 * 60  # how long idempotency keys are remembered
+
+
+class PermanentError(Exception):
+    """Game is rejected by API and retrying won't help."""
+
+
+class ResultPublisher(object):
+    """Publish confirmed games to Kortov.net in background.
+
+    Games are appended to a Redis stream and acknowledged to the user at
+    once. Workers read the stream in a consumer group, so game is removed
+    from the queue only after it is published and games of a crashed
+    worker are taken over by the others. Each game carries an idempotency
+    key: it is sent to API and remembered after success, so retries don't
+    create duplicate games.
+    """
+
+    def __init__(self, redis, api, stream=STREAM, group=GROUP, consumer=None,
+                 concurrency=CONCURRENCY, batch_size=1, max_attempts=MAX_ATTEMPTS,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        """Init.
+
+        batch_size greater than one publishes several games per API request.
+        """
+        super(ResultPublisher, self).__init__()
+        self.redis = redis
+        self.api = api
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = None
+        self._task = None
+        self._inflight = set()
+
+    async def enqueue(self, chat_id, game):
+        """Append game sent from the chat to the queue and return its idempotency key.
+
+        The key is derived from the game, so confirming it again after a
+        crash or a redelivered update doesn't publish it twice.
+        """
+        key = idempotency_key(chat_id, game)
+        await self.redis.xadd(self.stream, {'key': key, 'game': json.dumps(game)})
+        return key
+
+    async def start(self):
+        """Start publishing games in background."""
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, latest_id='0', mkstream=True)
+        except ReplyError as ex:
+            if 'BUSYGROUP' not in str(ex):
+                raise
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self, timeout=None):
+        """Stop reading the queue, publish games queued so far and wait for them for up to timeout."""
+        deadline = Deadline(timeout)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+            self._task = None
+            drain = asyncio.ensure_future(self._drain())
+            await asyncio.wait([drain], timeout=deadline.remaining())
+            drain.cancel()
+        if self._inflight:
+            _done, pending = await asyncio.wait(self._inflight, timeout=deadline.remaining())
+            if pending:
+                logger.warning("%s games are left to be published after restart.", len(pending))
+
+    async def _drain(self):
+        """Dispatch games left in the queue without blocking reads."""
+        while True:
+            entries = await self.redis.xread_group(
+                self.group, self.consumer, [self.stream],
+                timeout=None,
+                count=self.batch_size * self.concurrency,
+                latest_ids=['>']
+            )
+            if not entries:
+                return
+            await self._dispatch(entries)
+
+    async def run(self):
+        """Read the queue and publish games."""
+        # games left unpublished by previous run of this consumer go first
+        latest_id = '0'
+        while True:
+            try:
+                if latest_id == '>':
+                    await self._claim_stale()
+                # blocking read must not hold up commands sharing the connection
+                with await self.redis as conn:
+                    entries = await conn.xread_group(
+                        self.group, self.consumer, [self.stream],
+                        timeout=CLAIM_AFTER * 1000 // 10,
+                        count=self.batch_size * self.concurrency,
+                        latest_ids=[latest_id]
+                    )
+                if latest_id != '>':
+                    latest_id = entries[-1][1] if entries else '>'
+                await self._dispatch(entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reading games queue failed.")
+                await asyncio.sleep(self.base_delay)
+
+    async def _claim_stale(self):
+        pending = await self.redis.xpending(
+            self.stream, self.group, '-', '+', self.batch_size * self.concurrency
+        )
+        stale = [
+            entry_id for entry_id, consumer, idle, _ in pending
+            if consumer.decode() != self.consumer and idle > CLAIM_AFTER * 1000
+        ]
+        if stale:
+            entries = await self.redis.xclaim(
+                self.stream, self.group, self.consumer, CLAIM_AFTER * 1000, *stale
+            )
+            await self._dispatch([(self.stream, entry_id, fields) for entry_id, fields in entries])
+
+    async def _dispatch(self, entries):
+        games = [
+            (entry_id, fields[b'key'].decode(), json.loads(fields[b'game']))
+            for _, entry_id, fields in entries if fields
+        ]
+        for i in range(0, len(games), self.batch_size):
+            await self._semaphore.acquire()
+            task = asyncio.ensure_future(self._publish(games[i:i + self.batch_size]))
+            self._inflight.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._inflight.discard(task)
+        self._semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Publishing games failed: %r", task.exception())
+
+    def _published_key(self, key):
+        return "published:{}".format(key)
+
+    async def published(self, keys):
+        """Return for every idempotency key whether its game is published already."""
+        pipe = self.redis.pipeline()
+        found = [pipe.exists(self._published_key(key)) for key in keys]
+        await pipe.execute()
+        return [bool(await f) for f in found]
+
+    async def mark_published(self, keys):
+        """Remember idempotency keys of published games for PUBLISHED_TTL."""
+        pipe = self.redis.pipeline()
+        for key in keys:
+            pipe.set(self._published_key(key), b'1', expire=PUBLISHED_TTL)
+        await pipe.execute()
+
+    async def publish_now(self, chat_id, game):
+        """Publish game sent from the chat bypassing the queue, unless it is published already.
+
+        Unlike the queue failures are raised to the caller instead of retried.
+        """
+        key = idempotency_key(chat_id, game)
+        if (await self.published([key]))[0]:
+            logger.debug("Game %s is published already.", key)
+            return key
+        await self._send([(None, key, game)])
+        await self.mark_published([key])
+        return key
+
+    async def _publish(self, games):
+        published = await self.published([key for _, key, _ in games])
+        done = [entry_id for (entry_id, _, _), found in zip(games, published) if found]
+        await self._ack(done)
+        games = [game for game in games if game[0] not in done]
+        if not games:
+            return
+
+        for attempt in range(self.max_attempts):
+            try:
+                await self._send(games)
+            except PermanentError as ex:
+                logger.error("Games %s rejected: %s", [g for _, _, g in games], ex)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.5)
+                logger.warning("Publishing games failed (%r), retry in %.1fs.", ex, delay)
+                await asyncio.sleep(delay)
+            else:
+                await self.mark_published([key for _, key, _ in games])
+                await self._ack([entry_id for entry_id, _, _ in games])
+                return
+
+        await self._bury(games)
+
+    async def _send(self, games):
+        try:
+            if len(games) == 1:
+                _, key, game = games[0]
+                result = await self.api.publish_result(idempotency_key=key, **game)
+            else:
+                result = await self.api.publish_results([
+                    dict(game, idempotency_key=key) for _, key, game in games
+                ])
+        except aiohttp.ClientResponseError as ex:
+            if 400 <= ex.status < 500 and ex.status not in (408, 429):
+                raise PermanentError(ex)
+            raise
+        logger.debug("Games are published: %s", result)
+
+    async def _ack(self, entry_ids):
+        if entry_ids:
+            await self.redis.xack(self.stream, self.group, *entry_ids)
+            await self.redis.execute(b'XDEL', self.stream, *entry_ids)
+
+    async def _bury(self, games):
+        """Move games which can't be published to dead letter stream."""
+        ERRORS.labels('publisher').inc(len(games))
+        for _, key, game in games:
+            await self.redis.xadd(self.stream + ':dead', {'key': key, 'game': json.dumps(game)})
+        await self._ack([entry_id for entry_id, _, _ in games])
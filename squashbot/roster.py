@@ -0,0 +1,61 @@
+"""Roster of players shared by all chat handlers."""
+import types
+from squashbot.keyboards import row
+from squashbot.search import SearchIndex
+
+
+class Roster(object):
+    """Immutable roster of players with prebuilt per-league partitions.
+
+    Names are sorted and indexed once when the roster is loaded. Every league
+    is a Roster sharing the search index of the whole group, so choosing a
+    league is a dictionary lookup and nothing is copied. Keyboard rows of
+    the names are serialized once on first use and live as long as the roster.
+    """
+
+    __slots__ = ('names', 'ids', 'leagues', 'index', '_partitions', '_whole', '_rows')
+
+    def __init__(self, players, index=None):
+        """Build roster from (name, id, league_id) triples.
+
+        The last player wins if name is repeated.
+        """
+        super(Roster, self).__init__()
+        players = sorted({name: (name, id, league) for name, id, league in players}.values())
+        self.names = tuple(name for name, _, _ in players)
+        self.ids = types.MappingProxyType({name: id for name, id, _ in players})
+        self.leagues = types.MappingProxyType({name: league for name, _, league in players})
+        self._whole = index is None
+        self.index = SearchIndex(self.names) if self._whole else index
+        self._partitions = {}
+        self._rows = None
+        if self._whole:
+            groups = {}
+            for player in players:
+                groups.setdefault(player[2], []).append(player)
+            self._partitions = {league: Roster(group, self.index) for league, group in groups.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    @property
+    def rows(self):
+        """Return names with their serialized keyboard rows."""
+        if self._rows is None:
+            self._rows = tuple((name, row(name)) for name in self.names)
+        return self._rows
+
+    def league(self, league_id):
+        """Return players of the league."""
+        partition = self._partitions.get(league_id)
+        return partition if partition is not None else Roster((), self.index)
+
+    def search(self, text, limit=10):
+        """Return up to limit (name, score) pairs of the roster best matching the text."""
+        return self.index.search(text, limit=limit, allowed=None if self._whole else self.ids)
@@ -0,0 +1,109 @@
+"""Fuzzy search index for player names."""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+PREFIX_WEIGHT = 0.4  # part of the score given for token prefix matches
+MIN_OVERLAP = 0.5  # part of query trigrams shared by names scored without prefix match
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+# common alternative latin spellings of the same sounds
+SPELLINGS = [
+    ('kh', 'h'), ('yo', 'e'), ('ju', 'yu'), ('ja', 'ya'), ('shch', 'sh'),
+    ('sch', 'sh'), ('tz', 'ts'), ('x', 'ks'), ('w', 'v'), ('y', 'i'), ('j', 'i'),
+]
+TRANSLIT_TABLE = str.maketrans(TRANSLIT)
+NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """Return lowercased latin form of text with punctuation removed."""
+    text = text.replace('🔥', '').lower().translate(TRANSLIT_TABLE)
+    for spelling, canonical in SPELLINGS:
+        text = text.replace(spelling, canonical)
+    return NON_WORD.sub(' ', text).strip()
+
+
+def trigrams(token):
+    """Return set of padded trigrams of the token."""
+    padded = '  {} '.format(token)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex(object):
+    """Prebuilt index for fuzzy search among fixed list of names.
+
+    Names are normalized and transliterated once when index is built, so
+    cyrillic and latin spellings match each other. Query is narrowed with
+    trigram and token prefix postings. Only names starting a token with a
+    query token or sharing at least MIN_OVERLAP of its trigrams are scored,
+    the rest can't get into the top anyway.
+    """
+
+    def __init__(self, names):
+        """Build index for names."""
+        super(SearchIndex, self).__init__()
+        self.names = list(names)
+        self._sizes = []
+        self._grams = defaultdict(list)
+        self._prefixes = defaultdict(list)
+        for i, name in enumerate(self.names):
+            tokens = normalize(name).split()
+            grams = set()
+            for token in tokens:
+                grams |= trigrams(token)
+            for gram in grams:
+                self._grams[gram].append(i)
+            for prefix in {t[:n] for t in tokens for n in range(1, len(t) + 1)}:
+                self._prefixes[prefix].append(i)
+            self._sizes.append(len(grams))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _allowed(self, ids, allowed):
+        if allowed is None:
+            return set(ids)
+        return {i for i in ids if self.names[i] in allowed}
+
+    def search(self, text, limit=10, allowed=None):
+        """Return up to limit (name, score) pairs best matching the text.
+
+        Score is in 0..100 like in fuzzywuzzy. If allowed is specified only
+        names from it are returned.
+        """
+        tokens = normalize(text).split()
+        if not tokens:
+            return []
+        grams = set()
+        for token in tokens:
+            grams |= trigrams(token)
+
+        common = Counter()
+        for gram in grams:
+            common.update(self._grams.get(gram, ()))
+        prefixes = Counter()
+        for token in tokens:
+            prefixes.update(self._prefixes.get(token, ()))
+
+        least = math.ceil(MIN_OVERLAP * len(grams))
+        candidates = self._allowed([i for i, n in common.items() if n >= least] + list(prefixes), allowed)
+        if not candidates:
+            # nothing is close, suggest whatever shares something with the text
+            candidates = self._allowed(common, allowed)
+        # scores are computed inline, a function call per candidate costs more
+        similarity = 100 * (1 - PREFIX_WEIGHT) * 2.0
+        prefix = 100 * PREFIX_WEIGHT / len(tokens)
+        sizes = self._sizes
+        best = heapq.nlargest(limit, (
+            (similarity * common[i] / (len(grams) + sizes[i]) + prefix * min(prefixes[i], len(tokens)), -i)
+            for i in candidates
+        ))
+        return [(self.names[-i], int(round(score))) for score, i in best]
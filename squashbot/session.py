@@ -0,0 +1,103 @@
+"""Conversation state persisted in Redis."""
+import enum
+import json
+import pendulum
+
+MSK = 'Europe/Moscow'
+SESSION_TTL = 60  # seconds, matches default BOT_TIMEOUT
+
+GameInputStage = enum.Enum(
+    value='GameInputStage',
+    names=[
+        'start',
+        'date',
+        'time',
+        'location',
+        'first_player',
+        'second_player',
+        'result',
+        'confirmation',
+        'bulk'
+    ]
+)
+
+
+class Game(object):
+    """Game being entered in the chat."""
+
+    __slots__ = ('stage', 'league', 'location', 'time', 'player1', 'player2', 'result', 'bulk')
+
+    def __init__(self, stage=GameInputStage.start, league=None, location=None,
+                 time=None, player1=None, player2=None, result=None, bulk=None):
+        """Init."""
+        self.stage = stage
+        self.league = league
+        self.location = location
+        self.time = time
+        self.player1 = player1
+        self.player2 = player2
+        self.result = result
+        self.bulk = bulk  # games sent with /bulk waiting for confirmation
+
+    def dumps(self):
+        """Serialize game to compact json array."""
+        return json.dumps([
+            self.stage.value,
+            self.league,
+            self.location,
+            self.time.to_iso8601_string() if self.time is not None else None,
+            self.player1,
+            self.player2,
+            self.result,
+            self.bulk,
+        ], ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, raw):
+        """Deserialize game dumped with dumps."""
+        # sessions saved before bulk was added have one field less
+        stage, league, location, time, player1, player2, result, bulk = (json.loads(raw) + [None])[:8]
+        return cls(
+            stage=GameInputStage(stage),
+            league=league,
+            location=location,
+            time=pendulum.parse(time).in_timezone(MSK) if time is not None else None,
+            player1=player1,
+            player2=player2,
+            result=result,
+            bulk=bulk,
+        )
+
+
+class SessionStore(object):
+    """Store of games being entered keyed by chat id.
+
+    Any worker can resume the chat after restart while the session is not
+    expired.
+    """
+
+    def __init__(self, redis, ttl=SESSION_TTL):
+        """Init."""
+        super(SessionStore, self).__init__()
+        self.redis = redis
+        self.ttl = ttl
+
+    @staticmethod
+    def key(chat_id):
+        return "session:{}".format(chat_id)
+
+    async def load(self, chat_id):
+        """Return saved game for the chat or a new one."""
+        raw = await self.redis.get(self.key(chat_id))
+        return Game.loads(raw) if raw is not None else Game()
+
+    async def save(self, chat_id, game):
+        """Save game, finished or cancelled ones are removed."""
+        if game.stage == GameInputStage.start:
+            await self.redis.delete(self.key(chat_id))
+        else:
+            await self.redis.set(self.key(chat_id), game.dumps(), expire=self.ttl)
+
+    async def touch(self, chat_id):
+        """Prolong the session of the chat which is still in use."""
+        await self.redis.expire(self.key(chat_id), self.ttl)
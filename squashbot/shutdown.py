@@ -0,0 +1,60 @@
+"""Helpers for stopping the bot without losing work in progress."""
+import asyncio
+import time
+
+TIMEOUT = 25  # seconds to drain work, Heroku kills the dyno 30 seconds after SIGTERM
+SETTLE = 0.2  # seconds without updates being handled before handlers are considered idle
+POLL_INTERVAL = 0.05
+
+
+class Deadline(object):
+    """Time left for all steps of shutdown together."""
+
+    def __init__(self, timeout=None):
+        """Init, no timeout means waiting forever."""
+        super(Deadline, self).__init__()
+        self.at = time.monotonic() + timeout if timeout is not None else None
+
+    def remaining(self):
+        """Return seconds left or None without deadline."""
+        return None if self.at is None else max(self.at - time.monotonic(), 0)
+
+    @property
+    def expired(self):
+        return self.at is not None and time.monotonic() >= self.at
+
+
+class Inflight(object):
+    """Counter of updates being handled by chat handlers.
+
+    Handlers enter it for every update, so shutdown waits until the last
+    reply is sent and the session is saved. Next update of the same chat is
+    started only after the handler yields to the event loop, so the counter
+    has to stay zero for a moment to be sure handlers are idle.
+    """
+
+    def __init__(self):
+        """Init."""
+        super(Inflight, self).__init__()
+        self.count = 0
+
+    def __enter__(self):
+        self.count += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.count -= 1
+
+    async def wait(self, timeout=None, settle=SETTLE):
+        """Wait until no update is handled, return False on timeout."""
+        deadline = Deadline(timeout)
+        idle_since = None
+        while not deadline.expired:
+            if self.count:
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= settle:
+                return True
+            await asyncio.sleep(POLL_INTERVAL)
+        return False
@@ -0,0 +1,100 @@
+"""Last good API data kept on disk for fast and offline start."""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1  # increase when format of the file or of cached data changes
+SAVE_DELAY = 1  # seconds to collect updates of several caches into one write
+
+
+class Snapshot(object):
+    """Data of shared caches saved to a msgpack file.
+
+    Caches are warmed from the file at startup, so handlers have roster and
+    locations before the first download and even when msliga.ru is down.
+    Every successfully loaded value is written to a temporary file which
+    atomically replaces the snapshot, so a crash never leaves it partial.
+    """
+
+    def __init__(self, path, save_delay=SAVE_DELAY):
+        """Init."""
+        super(Snapshot, self).__init__()
+        self.path = path
+        self.save_delay = save_delay
+        self.entries = {}
+        self._task = None
+
+    def load(self):
+        """Read snapshot, return empty one if it is missing, broken or of other version."""
+        started = time.monotonic()
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = msgpack.unpackb(f.read(), raw=False)
+            if snapshot.get('version') != VERSION:
+                logger.info("Ignoring snapshot %s of version %s.", self.path, snapshot.get('version'))
+                return {}
+            self.entries = snapshot['entries']
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            logger.exception("Reading snapshot %s failed.", self.path)
+            return {}
+        logger.info("Snapshot %s is loaded in %.1fms.", self.path, (time.monotonic() - started) * 1000)
+        return self.entries
+
+    def track(self, *caches):
+        """Warm caches from the snapshot and save their new values to it."""
+        entries = self.load()
+        for cache in caches:
+            if cache.key in entries:
+                loaded_at, data = entries[cache.key]
+                try:
+                    cache.warm(data, loaded_at)
+                except Exception:
+                    logger.exception("Snapshot of %s is not usable.", cache.key)
+            cache.on_store = self.update
+
+    def update(self, key, data, loaded_at):
+        """Remember new value of the cache and schedule saving."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] >= loaded_at:
+            return
+        self.entries[key] = [loaded_at, data]
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._save())
+
+    async def _save(self):
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Write the snapshot without blocking the event loop."""
+        raw = msgpack.packb(dict(version=VERSION, entries=self.entries), use_bin_type=True)
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, raw)
+        except OSError:
+            logger.exception("Writing snapshot %s failed.", self.path)
+
+    def _write(self, raw):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    async def close(self):
+        """Write pending updates."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.wait([self._task])
+            await self.flush()
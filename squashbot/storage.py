@@ -0,0 +1,34 @@
+"""Shared Redis connection pool."""
+import asyncio
+import time
+import aioredis
+from squashbot.metrics import REDIS_SECONDS, ERRORS
+
+
+class TimedRedis(aioredis.Redis):
+    """Redis interface recording duration of every command."""
+
+    def execute(self, command, *args, **kwargs):
+        started = time.monotonic()
+        # pool returns coroutine instead of future when all connections are busy
+        future = asyncio.ensure_future(super(TimedRedis, self).execute(command, *args, **kwargs))
+        name = (command.decode() if isinstance(command, bytes) else command).upper()
+
+        def observe(future):
+            REDIS_SECONDS.labels(name).observe(time.monotonic() - started)
+            if not future.cancelled() and future.exception() is not None:
+                ERRORS.labels('redis').inc()
+
+        future.add_done_callback(observe)
+        return future
+
+
+async def create_redis(url, minsize=1, maxsize=10):
+    """Create pool of asynchronous Redis connections shared by all handlers."""
+    return await aioredis.create_redis_pool(url, minsize=minsize, maxsize=maxsize, commands_factory=TimedRedis)
+
+
+async def close_redis(redis):
+    """Close pool and wait for connections to be released."""
+    redis.close()
+    await redis.wait_closed()
@@ -3,12 +3,27 @@ import operator
 import pendulum
 import operator
 
+MAX_LENGTH = 4096  # limit of message text in Telegram
+
 
 def markdown_link(title, url):
     """Generates markdown link string."""
     return "[{}]({})".format(title, url)
 
 
+def split_lines(lines, limit=MAX_LENGTH):
+    """Join lines into as few texts not longer than limit as possible, longer lines are cut."""
+    texts = []
+    for line in lines:
+        if len(line) > limit:
+            line = line[:limit - 1] + '…'
+        if texts and len(texts[-1]) + 1 + len(line) <= limit:
+            texts[-1] += "\n" + line
+        else:
+            texts.append(line)
+    return texts
+
+
 def grouper(iterable, n):
     """Return list of lists group by n elements."""
     l = []
@@ -0,0 +1,169 @@
+"""Webhook ingestion of Telegram updates sharded by chat between workers."""
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import telepot
+from aiohttp import web
+from squashbot.app import SquashBot, configure_logging
+
+logger = logging.getLogger(__name__)
+
+CHAT_UPDATES = ['message', 'edited_message', 'channel_post', 'edited_channel_post']
+USER_UPDATES = ['inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query']
+MIN_SECRET = 32  # characters of the path which make it unguessable
+
+
+def secret_path(token):
+    """Return webhook path derived from the bot token, so only Telegram knows it."""
+    return '/' + hashlib.sha256(token.encode()).hexdigest()
+
+
+def update_chat_id(update):
+    """Return id of the chat the update belongs to."""
+    for key in CHAT_UPDATES:
+        if key in update:
+            return update[key]['chat']['id']
+    if 'callback_query' in update:
+        query = update['callback_query']
+        return query['message']['chat']['id'] if 'message' in query else query['from']['id']
+    for key in USER_UPDATES:
+        if key in update:
+            return update[key]['from']['id']
+    return 0
+
+
+def create_app(feed, path):
+    """Create web application passing updates posted to path to feed."""
+    async def receive(request):
+        data = await request.read()
+        try:
+            update = json.loads(data.decode())
+        except ValueError:
+            return web.Response(status=400)
+        feed(update, data)
+        return web.Response(text='OK')
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    return app
+
+
+def run_worker(index, workers, updates):
+    """Handle updates of one shard in separate process.
+
+    The worker is stopped by the parent process after the last update is
+    passed to it, signals sent to the whole group are ignored.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_logging()
+    loop = asyncio.get_event_loop()
+    bot = SquashBot.from_env(workers=workers)
+    if bot.metrics_port is not None:
+        # every worker serves its own metrics
+        bot.metrics_port += index
+    loop.run_until_complete(bot.start())
+    queue = asyncio.Queue()
+
+    def pull():
+        while True:
+            data = updates.get()
+            if data is None:
+                loop.call_soon_threadsafe(loop.stop)
+                return
+            loop.call_soon_threadsafe(queue.put_nowait, data)
+
+    threading.Thread(target=pull, daemon=True).start()
+    # every worker sees only part of update ids, so they can't be reordered
+    bot.listen(source=queue, ordered=False)
+    logger.debug('Worker #%s is listening ...', index)
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(bot.stop())
+        loop.close()
+
+
+class WebhookServer(object):
+    """HTTP server receiving Telegram updates.
+
+    With single worker updates are handled in the same process, otherwise
+    they are passed to worker processes by chat id, so each chat is always
+    handled by the same worker.
+
+    Anyone could post forged updates to a known path, so the path is a
+    secret shared with Telegram only. By default it is derived from the
+    token, a short path is refused.
+    """
+
+    def __init__(self, token, host='0.0.0.0', port=8080, path=None, workers=1, url=None):
+        """Init.
+
+        If url is specified the webhook is registered in Telegram on start.
+        """
+        super(WebhookServer, self).__init__()
+        path = path or secret_path(token)
+        if len(path.strip('/')) < MIN_SECRET:
+            raise ValueError("Webhook path {} is guessable, use at least {} random characters.".format(
+                path, MIN_SECRET
+            ))
+        self.token = token
+        self.host = host
+        self.port = port
+        self.path = path
+        self.workers = workers
+        self.url = url
+        self.bot = None
+        self._queues = []
+        self._processes = []
+        self._runner = None
+
+    def _feed_shard(self, update, data):
+        self._queues[update_chat_id(update) % self.workers].put(data)
+
+    async def start(self):
+        """Start workers and web server."""
+        if self.workers > 1:
+            context = multiprocessing.get_context('spawn')
+            for i in range(self.workers):
+                queue = context.Queue()
+                process = context.Process(target=run_worker, args=(i, self.workers, queue), daemon=True)
+                process.start()
+                self._queues.append(queue)
+                self._processes.append(process)
+            feed = self._feed_shard
+        else:
+            self.bot = SquashBot.from_env()
+            await self.bot.start()
+            queue = asyncio.Queue()
+            # telepot holds out of order updates in its own buffer, shutdown
+            # can't see them, and Telegram posts updates of a chat one by one
+            self.bot.listen(source=queue, ordered=False)
+            feed = lambda update, data: queue.put_nowait(update)
+
+        self._runner = web.AppRunner(create_app(feed, self.path))
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if self.url:
+            await telepot.aio.Bot(self.token).setWebhook(self.url + self.path)
+        logger.debug('Webhook is listening on %s:%s.', self.host, self.port)
+
+    async def stop(self):
+        """Stop accepting updates, then let workers handle received ones and stop.
+
+        Telegram resends updates which are not accepted meanwhile.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+        for queue in self._queues:
+            queue.put(None)
+        loop = asyncio.get_event_loop()
+        for process in self._processes:
+            # workers drain for SHUTDOWN_TIMEOUT themselves
+            await loop.run_in_executor(None, process.join)
+        if self.bot is not None:
+            await self.bot.stop()